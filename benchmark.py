@@ -0,0 +1,147 @@
+"""Banco de pruebas de rendimiento de main.py.
+
+Genera inventarios sintéticos con semilla fija (IDs estilo IAC-XXXXXX, estados, traslados y
+modalidades reales), mide la carga en frío y el guardado del almacén, y cronometra cada pestaña
+de la consola admin y el dashboard de cliente ejecutando la app sin navegador (streamlit.testing).
+
+    python benchmark.py                              # 1k, 10k, 100k y 1M filas
+    python benchmark.py --tamanos 1000 10000 --salida informe.json
+
+El informe JSON permite comparar versiones: mismas semillas y tamaños producen los mismos datos.
+Cada tamaño se mide en un subproceso propio, así la memoria y los hilos de un tamaño no se suman al siguiente.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import runpy
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+TAMANOS = [1_000, 10_000, 100_000, 1_000_000]
+ADMIN = {"nombre": "Admin", "rol": "admin", "correo": "admin"}
+
+def cronometrar(fn, repeticiones=1):
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    return {"min": min(tiempos), "mediana": statistics.median(tiempos), "n": repeticiones}
+
+def _ids_unicos(n, rng):
+    ids, alfabeto = set(), string.ascii_uppercase + string.digits
+    while len(ids) < n: ids.add(f"IAC-{''.join(rng.choices(alfabeto, k=6))}")
+    return sorted(ids, key=lambda _: rng.random())
+
+def generar_datos(app, n, semilla):
+    """Inventario de n paquetes, n//10 clientes y n avisos, con los valores de dominio de main.py."""
+    rng = random.Random(semilla)
+    n_cli = max(1, n // 10)
+    usuarios = [{"nombre": f"Cliente {k}", "correo": f"cliente{k}@iacargo.test", "password": app['hash_password'](f"clave{k}"), "rol": "cliente"} for k in range(n_cli)]
+    ahora = datetime.now()
+    inventario = []
+    for i in _ids_unicos(n, rng):
+        u = usuarios[rng.randrange(n_cli)]
+        peso = round(rng.uniform(0.5, 80.0), 1)
+        validado = rng.random() < 0.7
+        # ~5% de los validados con una diferencia de peso que dispara la alerta de variación.
+        real = round(peso * (rng.uniform(1.1, 1.5) if rng.random() < 0.05 else rng.uniform(0.995, 1.005)), 1) if validado else 0.0
+        inventario.append({"ID_Barra": i, "Cliente": u['nombre'], "Correo": u['correo'], "Peso_Mensajero": peso, "Peso_Almacen": real, "Validado": validado,
+                           "Estado": rng.choice(app['ESTADOS']), "Pago": rng.choice(app['ESTADOS_PAGO']), "Modalidad": rng.choice(app['MODALIDADES']),
+                           "Tipo_Traslado": rng.choice(app['TIPOS_TRASLADO']), "Reempaque": rng.random() < 0.2,
+                           "Fecha_Registro": ahora - timedelta(days=rng.uniform(0, 90)), "Historial_Pagos": [], "Version": 1})
+    montos = app['calcular_montos']([p['Peso_Almacen'] if p['Validado'] else p['Peso_Mensajero'] for p in inventario],
+                                    [p['Tipo_Traslado'] for p in inventario], [p['Reempaque'] for p in inventario])
+    version = app['version_tarifa_vigente']()
+    for p, m in zip(inventario, montos):
+        p['Monto_USD'], p['Tarifa_Version'] = float(m), version
+        p['Abonado'] = p['Monto_USD'] if p['Pago'] == 'PAGADO' else round(p['Monto_USD'] * rng.choice((0.0, 0.0, 0.5)), 2)
+    avisos = [{"fecha": (ahora - timedelta(minutes=k)).strftime("%Y-%m-%d %H:%M:%S"), "para": p['Correo'], "msg": f"Tu paquete {p['ID_Barra']} está en: {p['Estado']}"}
+              for k, p in enumerate(rng.choices(inventario, k=n))]
+    return inventario, usuarios, avisos
+
+def medir_app(app, tabs, cliente, repeticiones, timeout):
+    """Primera ejecución (almacén compartido en frío) y reruns de cada pestaña admin y del dashboard de cliente."""
+    res, errores = {}, []
+    app['ESCRITOR'].detener()  # la caché se descarta: su hilo escritor no debe quedar vivo junto al nuevo
+    st.cache_resource.clear()
+    at = AppTest.from_file(MAIN, default_timeout=timeout)
+    at.session_state["usuario_identificado"], at.session_state["landing_vista"] = ADMIN, False
+    res["arranque_admin"] = cronometrar(at.run)
+    res["pestanas"] = {}
+    for tab in tabs:
+        at.session_state["tab_admin"] = tab
+        res["pestanas"][tab] = cronometrar(at.run, repeticiones)
+        errores += [f"{tab}: {e.message}" for e in at.exception]
+    at = AppTest.from_file(MAIN, default_timeout=timeout)
+    at.session_state["usuario_identificado"], at.session_state["landing_vista"] = cliente, False
+    res["arranque_cliente"] = cronometrar(at.run)
+    res["cliente"] = cronometrar(at.run, repeticiones)
+    errores += [f"cliente: {e.message}" for e in at.exception]
+    return res, errores
+
+def medir_tamano(n, semilla, repeticiones, timeout):
+    previa = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="iacargo-bench-") as carpeta:
+        os.chdir(carpeta)
+        try: return _medir_en(carpeta, n, semilla, repeticiones, timeout)
+        finally: os.chdir(previa)
+
+def _medir_en(carpeta, n, semilla, repeticiones, timeout):
+    st.cache_resource.clear()
+    app = runpy.run_path(MAIN, run_name="iacargo_benchmark")
+    t0 = time.perf_counter()
+    inventario, usuarios, avisos = generar_datos(app, n, semilla)
+    res = {"filas": n, "generacion_s": time.perf_counter() - t0}
+    res["guardar_datos"] = cronometrar(lambda: app['guardar_datos'](inventario, app['ARCHIVO_DB']), repeticiones)
+    app['guardar_datos'](usuarios, app['ARCHIVO_USUARIOS']); app['guardar_datos'](avisos, app['ARCHIVO_NOTIF'])
+    res["bytes_en_disco"] = sum(os.path.getsize(f) for f in os.listdir(carpeta) if os.path.isfile(f))
+    res["cargar_datos"] = cronometrar(lambda: app['cargar_datos'](app['ARCHIVO_DB']), repeticiones)
+    app_res, res["errores"] = medir_app(app, list(app['PESTANAS_ADMIN']), usuarios[0], repeticiones, timeout)
+    res.update(app_res)
+    return res
+
+def medir_en_subproceso(n, args):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f: parcial = f.name
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--un-tamano", str(n), "--semilla", str(args.semilla),
+                        "--repeticiones", str(args.repeticiones), "--timeout", str(args.timeout), "--salida", parcial], check=True)
+        with open(parcial, encoding="utf-8") as f: return json.load(f)
+    finally: os.remove(parcial)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS)
+    ap.add_argument("--semilla", type=int, default=7)
+    ap.add_argument("--repeticiones", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=900, help="segundos máximos por ejecución de la app")
+    ap.add_argument("--salida", default=f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    ap.add_argument("--un-tamano", type=int, help=argparse.SUPPRESS)  # modo subproceso: mide un tamaño y vuelca su resultado en --salida
+    args = ap.parse_args()
+    salida = os.path.abspath(args.salida)
+    if args.un_tamano:
+        res = medir_tamano(args.un_tamano, args.semilla, args.repeticiones, args.timeout)
+        with open(salida, "w", encoding="utf-8") as f: json.dump(res, f, ensure_ascii=False)
+        return
+    informe = {"fecha": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "streamlit": st.__version__,
+               "backend": os.environ.get("IACARGO_BACKEND", "archivos"), "snapshot": os.environ.get("IACARGO_SNAPSHOT", "parquet"),
+               "diario": os.environ.get("IACARGO_DIARIO", "1"), "semilla": args.semilla, "resultados": []}
+    for n in args.tamanos:
+        print(f"· {n} filas…", file=sys.stderr, flush=True)
+        informe["resultados"].append(medir_en_subproceso(n, args))
+        with open(salida, "w", encoding="utf-8") as f: json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(salida)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,21 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import hashlib
 import random
 import string
+import ast
+import json
+import sqlite3
+import time
+import threading
+import queue
+import heapq
+import functools
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from itertools import islice
 from datetime import datetime
 
 # --- 1. CONFIGURACIÓN E IDENTIDAD VISUAL ---
@@ -13,6 +25,15 @@ TARIFA_AEREO_KG = 6.0
 TARIFA_MARITIMO_FT3 = 15.0  
 COSTO_REEMPAQUE_FIJO = 5.0 
 
+ESTADOS = ["RECIBIDO ALMACEN PRINCIPAL", "EN TRANSITO", "RECIBIDO EN ALMACEN DE DESTINO", "ENTREGADO"]
+TIPOS_TRASLADO = ["Aéreo", "Marítimo", "Envio Nacional"]
+MODALIDADES = ["Pago Completo", "Cobro Destino", "Pago en Cuotas"]
+ESTADOS_PAGO = ["PENDIENTE", "PAGADO"]
+
+# Umbrales del centro de alertas: variación de peso/volumen tolerada y días de morosidad.
+UMBRAL_VARIACION = float(os.environ.get("IACARGO_UMBRAL_VARIACION", 0.01))
+DIAS_MOROSIDAD = int(os.environ.get("IACARGO_DIAS_MOROSIDAD", 15))
+
 st.markdown("""
     <style>
     /* Fondo y Base */
@@ -40,6 +61,9 @@ st.markdown("""
         color: rgba(255, 255, 255, 0.6) !important;
     }
 
+    /* Selector de secciones de la consola (radio horizontal) con el mismo aspecto */
+    div[role="radiogroup"] label p { color: white !important; font-weight: 700 !important; font-size: 14px !important; }
+
     /* --- EXPANDERS AZULES PERMANENTES --- */
     [data-testid="stExpander"] summary {
         background-color: #2563eb !important; 
@@ -112,245 +136,1551 @@ st.markdown("""
 
 # --- 2. GESTIÓN DE DATOS ---
 ARCHIVO_DB, ARCHIVO_USUARIOS, ARCHIVO_PAPELERA, ARCHIVO_NOTIF = "inventario_logistica.csv", "usuarios_iacargo.csv", "papelera_iacargo.csv", "notificaciones_iac.csv"
+ARCHIVOS = {'inventario': ARCHIVO_DB, 'papelera': ARCHIVO_PAPELERA, 'usuarios': ARCHIVO_USUARIOS, 'notificaciones': ARCHIVO_NOTIF}
+
+# --- Instrumentación (opcional) ---
+# Con IACARGO_METRICAS=1 se miden las llamadas a la capa de datos y el render de cada pestaña
+# (últimas MUESTRAS_METRICAS duraciones por tramo) y se cuentan filas leídas, bytes escritos y reruns.
+# Desactivada, medir() es un nullcontext y medido() devuelve la función sin envolver.
+METRICAS_ACTIVAS = os.environ.get("IACARGO_METRICAS", "0") == "1"
+MUESTRAS_METRICAS = int(os.environ.get("IACARGO_MUESTRAS_METRICAS", 2000))
+ARCHIVO_METRICAS = os.environ.get("IACARGO_ARCHIVO_METRICAS", "metricas_iacargo.jsonl")
+
+class Metricas:
+    def __init__(self):
+        self.bloqueo = threading.Lock()
+        self.tramos, self.contadores = {}, {}
+
+    def registrar(self, nombre, segundos):
+        with self.bloqueo: self.tramos.setdefault(nombre, deque(maxlen=MUESTRAS_METRICAS)).append(segundos)
+
+    def sumar(self, nombre, n=1):
+        with self.bloqueo: self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def resumen(self):
+        """Una fila por tramo con n, p50, p95 y máximo en milisegundos, de mayor a menor p95."""
+        with self.bloqueo: tramos = {k: np.array(v) * 1000 for k, v in self.tramos.items()}
+        filas = [{"Tramo": k, "n": len(v), "p50_ms": np.percentile(v, 50), "p95_ms": np.percentile(v, 95), "max_ms": v.max()} for k, v in tramos.items()]
+        return sorted(filas, key=lambda f: -f['p95_ms'])
+
+    def exportar(self, ruta=ARCHIVO_METRICAS):
+        """Anexa a `ruta` una línea JSON con el resumen y los contadores actuales."""
+        with self.bloqueo: contadores = dict(self.contadores)
+        linea = {"fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "pid": os.getpid(), "tramos": self.resumen(), "contadores": contadores}
+        with open(ruta, "a", encoding="utf-8") as f: f.write(json.dumps(linea, default=float, ensure_ascii=False) + "\n")
+        return ruta
+
+    def reiniciar(self):
+        with self.bloqueo: self.tramos, self.contadores = {}, {}
+
+@st.cache_resource
+def metricas(): return Metricas()
+
+METRICAS = metricas()
+
+@contextmanager
+def _tramo(nombre):
+    t0 = time.perf_counter()
+    try: yield
+    finally: METRICAS.registrar(nombre, time.perf_counter() - t0)
+
+def medir(nombre): return _tramo(nombre) if METRICAS_ACTIVAS else nullcontext()
+
+def medido(nombre):
+    def decorador(fn):
+        if not METRICAS_ACTIVAS: return fn
+        @functools.wraps(fn)
+        def envuelta(*args, **kwargs):
+            with _tramo(nombre): return fn(*args, **kwargs)
+        return envuelta
+    return decorador
+
+def contar(nombre, n=1):
+    if METRICAS_ACTIVAS: METRICAS.sumar(nombre, n)
+
+# --- Motor de tarifas ---
+# Versiones con fecha de vigencia guardadas en ARCHIVO_TARIFAS; cada modo de traslado tiene tramos
+# [hasta, tarifa por unidad] (hasta=None es el último tramo). Sin archivo rige la versión "base",
+# construida con las constantes TARIFA_*. Los montos se calculan por columnas completas con NumPy.
+ARCHIVO_TARIFAS = "tarifas_iacargo.json"
+
+class TablaTarifas:
+    def __init__(self, versiones):
+        self.versiones = sorted(versiones, key=lambda v: v['vigente_desde'])
+
+    @staticmethod
+    def version_base():
+        return {"version": "base", "vigente_desde": "2000-01-01", "reempaque": COSTO_REEMPAQUE_FIJO,
+                "modos": {"Aéreo": [[None, TARIFA_AEREO_KG]], "Marítimo": [[None, TARIFA_MARITIMO_FT3]], "Envio Nacional": [[None, 5.0]]}}
+
+    @classmethod
+    def cargar(cls, ruta=ARCHIVO_TARIFAS):
+        versiones = []
+        if os.path.exists(ruta):
+            try:
+                with open(ruta, encoding="utf-8") as f: versiones = json.load(f)
+            except ValueError: versiones = []
+        return cls(versiones or [cls.version_base()])
+
+    def guardar(self, ruta=ARCHIVO_TARIFAS):
+        with open(f"{ruta}.tmp", "w", encoding="utf-8") as f: json.dump(self.versiones, f, ensure_ascii=False, indent=2)
+        os.replace(f"{ruta}.tmp", ruta)
+
+    def agregar_version(self, version):
+        self.versiones = sorted(self.versiones + [version], key=lambda v: v['vigente_desde'])
+        self.guardar()
+
+    def vigente(self, fecha=None):
+        dia = (fecha or datetime.now()).strftime("%Y-%m-%d")
+        candidatas = [v for v in self.versiones if v['vigente_desde'] <= dia]
+        return candidatas[-1] if candidatas else self.versiones[0]
+
+    @staticmethod
+    def _tarifa_por_tramo(tramos, valores):
+        limites = np.array([np.inf if h is None else float(h) for h, _ in tramos])
+        tarifas = np.array([float(t) for _, t in tramos])
+        return tarifas[np.minimum(np.searchsorted(limites, valores, side='left'), len(tarifas) - 1)]
+
+    def calcular(self, valores, tipos, aplica_reempaque, fecha=None):
+        """(montos, versión) para columnas completas con la versión vigente en `fecha`."""
+        v = self.vigente(fecha)
+        valores, tipos = np.asarray(valores, dtype='float64'), np.asarray(tipos, dtype=object)
+        # Modos desconocidos se tarifan como "Envio Nacional", igual que la fórmula original.
+        tarifa = self._tarifa_por_tramo(v['modos'].get("Envio Nacional", [[None, 5.0]]), valores)
+        for modo, tramos in v['modos'].items():
+            mascara = tipos == modo
+            if mascara.any(): tarifa = np.where(mascara, self._tarifa_por_tramo(tramos, valores), tarifa)
+        extra = np.where(np.asarray(aplica_reempaque, dtype=bool), float(v.get('reempaque', COSTO_REEMPAQUE_FIJO)), 0.0)
+        return valores * tarifa + extra, v['version']
+
+@st.cache_resource
+def tabla_tarifas(): return TablaTarifas.cargar()
+
+def version_tarifa_vigente(): return tabla_tarifas().vigente()['version']
 
 def calcular_monto(valor, tipo, aplica_reempaque=False):
-    monto = (valor * TARIFA_AEREO_KG) if tipo == "Aéreo" else (valor * TARIFA_MARITIMO_FT3) if tipo == "Marítimo" else (valor * 5.0)
-    return monto + COSTO_REEMPAQUE_FIJO if aplica_reempaque else monto
+    return float(tabla_tarifas().calcular([valor], [tipo], [aplica_reempaque])[0][0])
 
-def registrar_notificacion(para, msg):
-    nueva = {"hora": datetime.now().strftime("%H:%M"), "para": para, "msg": msg}
-    if 'notificaciones' not in st.session_state: st.session_state.notificaciones = []
-    st.session_state.notificaciones.insert(0, nueva)
-    pd.DataFrame(st.session_state.notificaciones).to_csv(ARCHIVO_NOTIF, index=False)
+def calcular_montos(valores, tipos, aplica_reempaque):
+    """Versión vectorizada de calcular_monto sobre columnas completas."""
+    return tabla_tarifas().calcular(valores, tipos, aplica_reempaque)[0]
 
-def cargar_datos(archivo):
-    if os.path.exists(archivo):
+def repreciar_pendientes():
+    """Recalcula Monto_USD de todos los paquetes no pagados con la tarifa vigente. Devuelve (cambiados, segundos)."""
+    t0 = time.perf_counter()
+    with DATOS.bloqueo:
+        inv = DATOS.obtener('inventario')
+        m = inv.marco()
+        pend = m[m['Pago'] != 'PAGADO']
+        valores = np.where(pend['Validado'], pend['Peso_Almacen'], pend['Peso_Mensajero'])
+        montos, version = tabla_tarifas().calcular(valores, pend['Tipo_Traslado'].astype(object), pend['Reempaque'])
+        cambia = ~np.isclose(montos, pend['Monto_USD'].to_numpy(), equal_nan=True) | (pend['Tarifa_Version'] != version).to_numpy()
+        registros = inv.actualizar_montos(pend.index[cambia], montos[cambia], version)
+        if registros: ESCRITOR.encolar('inventario', 'update', registros)
+    return len(registros), time.perf_counter() - t0
+
+def registrar_notificacion(para, msg): registrar_notificaciones([(para, msg)])
+
+def registrar_notificaciones(avisos):
+    """Publica varios avisos (para, msg); la escritura al almacén la agrupa ESCRITOR."""
+    fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    nuevas = [{"fecha": fecha, "para": para, "msg": msg} for para, msg in avisos]
+    with DATOS.bloqueo:
+        buzon = DATOS.obtener('notificaciones')
+        for n in nuevas: buzon.publicar(n)
+        ESCRITOR.encolar('notificaciones', 'append', nuevas)
+
+# --- Diario de cambios (append-only) ---
+# Cada alta/edición/baja de inventario y papelera (y cada aviso nuevo, op 'append') se anexa como una
+# línea JSON al diario del archivo en lugar de reescribir el archivo completo. cargar_datos reproduce
+# snapshot + diario y, al superar UMBRAL_COMPACTACION bytes, el diario se compacta en un snapshot
+# nuevo en un hilo aparte.
+MODO_DIARIO = os.environ.get("IACARGO_DIARIO", "1") != "0"
+UMBRAL_COMPACTACION = int(os.environ.get("IACARGO_UMBRAL_COMPACTACION", 2_000_000))
+
+# Streamlit vuelve a ejecutar este script en cada rerun: el cerrojo del diario y el registro de
+# compactaciones en curso deben ser únicos por proceso, no por ejecución.
+@st.cache_resource
+def _estado_diario(): return threading.Lock(), set()
+
+_bloqueo_diario, _compactando = _estado_diario()
+
+def _stat(ruta):
+    try: return os.stat(ruta)
+    except OSError: return None
+
+def _ruta_diario(archivo): return f"{archivo}.journal"
+def _ruta_rotado(archivo): return f"{archivo}.journal.compactando"
+
+def _serializar(valor):
+    if isinstance(valor, datetime): return valor.isoformat()
+    if hasattr(valor, 'item'): return valor.item()
+    return str(valor)
+
+def _reproducir_diario(datos, archivo):
+    rutas = [r for r in (_ruta_rotado(archivo), _ruta_diario(archivo)) if os.path.exists(r)]
+    if not rutas: return datos
+    por_id = {r['ID_Barra']: r for r in datos if r.get('ID_Barra') is not None}
+    sueltos = [r for r in datos if r.get('ID_Barra') is None]  # registros sin clave (avisos): solo se anexan
+    for ruta in rutas:
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                # Una línea ilegible (truncada por un corte a mitad de escritura o mal formada) se salta sola;
+                # el resto del diario se sigue aplicando.
+                try:
+                    cambio = json.loads(linea)
+                    op, id_barra, reg = cambio['op'], cambio['id'], cambio['reg']
+                    if op != 'delete' and not isinstance(reg, dict): continue
+                except (ValueError, KeyError, TypeError): continue
+                if op == 'delete': por_id.pop(id_barra, None)
+                elif op == 'append': sueltos.append(reg)
+                else:
+                    if reg.get('Fecha_Registro'): reg['Fecha_Registro'] = pd.to_datetime(reg['Fecha_Registro'], errors='coerce')
+                    por_id[id_barra] = reg
+    return list(por_id.values()) + sueltos
+
+# --- Snapshot binario ---
+# El snapshot se escribe en Parquet (tabla tipada, lectura sin trabajo por fila en Python) con
+# Historial_Pagos en una tabla lateral <base>.pagos.parquet. El CSV queda como formato de
+# importación/exportación; al cargar se usa el snapshot más reciente de los dos.
+FORMATO_SNAPSHOT = os.environ.get("IACARGO_SNAPSHOT", "parquet")
+
+def _ruta_binaria(archivo): return f"{os.path.splitext(archivo)[0]}.parquet"
+def _ruta_pagos(archivo): return f"{os.path.splitext(archivo)[0]}.pagos.parquet"
+
+def _desplegar_pagos(pares):
+    filas = [{'ID_Barra': i, **(h if isinstance(h, dict) else {'Detalle': h})}
+             for i, r in pares if isinstance(r.get('Historial_Pagos'), list) for h in r['Historial_Pagos']]
+    return pd.DataFrame(filas) if filas else pd.DataFrame(columns=['ID_Barra', 'Detalle'])
+
+def _leer_csv(archivo):
+    df = pd.read_csv(archivo)
+    if 'Fecha_Registro' in df.columns: df['Fecha_Registro'] = pd.to_datetime(df['Fecha_Registro'])
+    if 'Historial_Pagos' in df.columns: df['Historial_Pagos'] = df['Historial_Pagos'].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else [])
+    return df.to_dict('records')
+
+def _leer_binario(archivo):
+    datos = pd.read_parquet(_ruta_binaria(archivo), memory_map=True).to_dict('records')
+    if os.path.exists(_ruta_pagos(archivo)):
+        pagos = pd.read_parquet(_ruta_pagos(archivo))
+        historial = {i: g.drop(columns='ID_Barra').dropna(axis=1, how='all').to_dict('records') for i, g in pagos.groupby('ID_Barra', sort=False)}
+        for r in datos: r['Historial_Pagos'] = historial.get(r.get('ID_Barra'), [])
+    return datos
+
+def _leer_archivo(archivo):
+    datos = []
+    csv, binario = _stat(archivo), _stat(_ruta_binaria(archivo))
+    try:
+        if binario and (not csv or binario.st_mtime_ns >= csv.st_mtime_ns): datos = _leer_binario(archivo)
+        elif csv: datos = _leer_csv(archivo)
+    except pd.errors.EmptyDataError: datos = []
+    return _reproducir_diario(datos, archivo)
+
+def _cargar_archivo(archivo):
+    # Con el cerrojo del diario: un compactado no puede publicar su snapshot a mitad de la lectura.
+    with _bloqueo_diario: return _leer_archivo(archivo)
+
+def _escribir_csv(datos, destino):
+    tmp = f"{destino}.tmp"
+    pd.DataFrame(list(datos)).to_csv(tmp, index=False)
+    contar('bytes_escritos', os.path.getsize(tmp))
+    os.replace(tmp, destino)
+
+def _preparar_snapshot(datos, archivo, sufijo=".tmp"):
+    """Escribe el snapshot en archivos temporales (`sufijo`) y devuelve los pares (tmp, destino) que lo publican."""
+    datos = list(datos)
+    if FORMATO_SNAPSHOT == "parquet":
         try:
-            df = pd.read_csv(archivo)
-            if 'Fecha_Registro' in df.columns: df['Fecha_Registro'] = pd.to_datetime(df['Fecha_Registro'])
-            if 'Historial_Pagos' in df.columns: df['Historial_Pagos'] = df['Historial_Pagos'].apply(lambda x: eval(x) if isinstance(x, str) else [])
-            return df.to_dict('records')
-        except: return []
-    return []
-
-def guardar_datos(datos, archivo): pd.DataFrame(datos).to_csv(archivo, index=False)
+            pares, df = [], pd.DataFrame(datos)
+            if 'Historial_Pagos' in df.columns:
+                _desplegar_pagos((r.get('ID_Barra'), r) for r in datos).to_parquet(f"{_ruta_pagos(archivo)}{sufijo}", index=False)
+                pares.append((f"{_ruta_pagos(archivo)}{sufijo}", _ruta_pagos(archivo)))
+                df = df.drop(columns='Historial_Pagos')
+            df.to_parquet(f"{_ruta_binaria(archivo)}{sufijo}", index=False)
+            pares.append((f"{_ruta_binaria(archivo)}{sufijo}", _ruta_binaria(archivo)))
+            if METRICAS_ACTIVAS: contar('bytes_escritos', sum(os.path.getsize(tmp) for tmp, _ in pares))
+            return pares
+        except Exception:
+            # Columnas con tipos mezclados que Arrow no admite (o pyarrow ausente): se cae al CSV sin dejar
+            # temporales a medio escribir. El contador permite ver en DIAGNÓSTICO cuántas veces ocurre.
+            for tmp in (f"{_ruta_pagos(archivo)}{sufijo}", f"{_ruta_binaria(archivo)}{sufijo}"):
+                if os.path.exists(tmp): os.remove(tmp)
+            contar('fallos_parquet')
+    pd.DataFrame(datos).to_csv(f"{archivo}{sufijo}", index=False)
+    contar('bytes_escritos', os.path.getsize(f"{archivo}{sufijo}"))
+    return [(f"{archivo}{sufijo}", archivo)]
+
+def _escribir_snapshot(datos, archivo):
+    for tmp, destino in _preparar_snapshot(datos, archivo): os.replace(tmp, destino)
+
+def _ruta_exportacion(archivo): return f"{os.path.splitext(archivo)[0]}.export.csv"
+
+def exportar_csv(archivo, destino=None):
+    """Vuelca el contenido actual (snapshot + diario) de `archivo` a CSV y devuelve la ruta escrita.
+
+    Por defecto escribe <base>.export.csv. Si el destino es el propio `archivo` (backend de archivos), el
+    diario queda absorbido en ese CSV y se descarta, para no reproducirlo dos veces en la próxima carga."""
+    destino = destino or _ruta_exportacion(archivo)
+    if ALMACEN.nombre == "archivos" and os.path.abspath(destino) == os.path.abspath(archivo):
+        with _bloqueo_diario:
+            _escribir_csv(_leer_archivo(archivo), archivo)
+            for ruta in (_ruta_diario(archivo), _ruta_rotado(archivo)):
+                if os.path.exists(ruta): os.remove(ruta)
+    else: _escribir_csv(cargar_datos(archivo), destino)
+    return destino
+
+def importar_csv(archivo, origen):
+    """Carga un CSV externo como contenido completo de `archivo` (reemplaza snapshot y diario)."""
+    datos = _leer_csv(origen)
+    guardar_datos(datos, archivo)
+    return datos
+
+def _guardar_archivo(datos, archivo):
+    # Reescritura completa: el diario (y el rotado de un compactado pendiente o fallido) queda absorbido
+    # en el snapshot y se descarta; si no, sus cambios antiguos se reproducirían sobre el snapshot nuevo.
+    with _bloqueo_diario:
+        _escribir_snapshot(datos, archivo)
+        for ruta in (_ruta_diario(archivo), _ruta_rotado(archivo)):
+            if os.path.exists(ruta): os.remove(ruta)
+
+def _registrar_archivo(datos, archivo, op, registros):
+    # `datos` puede ser None (escritor en segundo plano sin copia del contenido): solo se anexa al
+    # diario y, sin diario, la reescritura completa la hace el último grupo de la clave.
+    if not MODO_DIARIO: return _guardar_archivo(datos, archivo) if datos is not None else None
+    lineas = "".join(json.dumps({"op": op, "id": r.get('ID_Barra'), "reg": None if op == 'delete' else r}, default=_serializar, ensure_ascii=False) + "\n" for r in registros)
+    with _bloqueo_diario:
+        with open(_ruta_diario(archivo), "a", encoding="utf-8") as f: f.write(lineas)
+        tam = os.path.getsize(_ruta_diario(archivo))
+    contar('bytes_escritos', len(lineas.encode("utf-8")))
+    if tam > UMBRAL_COMPACTACION and datos is not None: compactar_datos(datos, archivo)
+
+def compactar_datos(datos, archivo):
+    with _bloqueo_diario:
+        if archivo in _compactando or not os.path.exists(_ruta_diario(archivo)): return
+        _compactando.add(archivo)
+        if os.path.exists(_ruta_rotado(archivo)):
+            # Un compactado previo no terminó: se conserva su diario y se le anexa el actual.
+            with open(_ruta_rotado(archivo), "a", encoding="utf-8") as dst, open(_ruta_diario(archivo), encoding="utf-8") as src: dst.write(src.read())
+            os.remove(_ruta_diario(archivo))
+        else: os.replace(_ruta_diario(archivo), _ruta_rotado(archivo))
+        copia = [dict(r) for r in datos]
+    threading.Thread(target=_compactar, args=(copia, archivo), daemon=True).start()
+
+def _compactar(copia, archivo):
+    try:
+        pares = _preparar_snapshot(copia, archivo, ".compactando.tmp")
+        # Publicar el snapshot y retirar el diario rotado es un solo paso para las cargas, que toman el
+        # mismo cerrojo: nunca ven el snapshot nuevo junto al diario que ya contiene (avisos duplicados).
+        with _bloqueo_diario:
+            if not os.path.exists(_ruta_rotado(archivo)):
+                # Un guardado completo posterior ya absorbió el diario rotado: este snapshot es más antiguo.
+                for tmp, _ in pares: os.remove(tmp)
+                return
+            for tmp, destino in pares: os.replace(tmp, destino)
+            os.remove(_ruta_rotado(archivo))
+    except: return  # el diario rotado sigue en disco y se reproduce en la próxima carga
+    finally:
+        with _bloqueo_diario: _compactando.discard(archivo)
+    # Escritura propia: la copia compartida ya tiene este contenido y no debe recargarse.
+    clave = next((c for c, a in ARCHIVOS.items() if a == archivo), None)
+    if clave: DATOS.marcar_escrito(clave)
+
+# --- Capa de almacenamiento ---
+# cargar_datos/guardar_datos/registrar_lote delegan en ALMACEN: AlmacenArchivos (snapshot + diario, por
+# defecto) o AlmacenSQLite (IACARGO_BACKEND=sqlite). Los paquetes se consultan con los índices en
+# memoria del Inventario; al backend solo llegan las búsquedas por igualdad de usuarios (login por
+# Correo, con índice en SQLite).
+COLUMNAS_INDEXADAS = ('ID_Barra', 'Correo', 'Estado', 'Pago', 'Validado', 'Cliente')
+
+def version_registro(reg):
+    """Version como entero; ausente o NaN (snapshots que mezclan filas antiguas y versionadas) cuenta como 0."""
+    try: v = float(reg.get('Version') or 0)
+    except (TypeError, ValueError): return 0
+    return int(v) if v == v else 0
+
+def _valor_columna(reg, col):
+    # Correo es el dueño del registro: Correo del paquete, correo del usuario o destinatario del aviso.
+    if col == 'Correo': return reg.get('Correo', reg.get('correo', reg.get('para')))
+    return reg.get(col)
+
+def _clave_indice(reg, col):
+    v = _valor_columna(reg, col)
+    if col == 'Correo': return str(v).lower() if v is not None else None
+    if col == 'Validado': return bool(v)
+    return v
+
+# --- Marco columnar del inventario ---
+# Esquema fijo: categóricas para los campos tipo enumeración, float64 para montos y pesos, datetime64
+# para Fecha_Registro. Historial_Pagos no entra en el marco: se expone aparte como tabla de pagos.
+ESQUEMA_MARCO = {
+    'ID_Barra': 'str', 'Cliente': 'str', 'Correo': 'str',
+    'Peso_Mensajero': 'float64', 'Peso_Almacen': 'float64', 'Validado': 'bool', 'Monto_USD': 'float64',
+    'Estado': pd.CategoricalDtype(ESTADOS), 'Pago': pd.CategoricalDtype(ESTADOS_PAGO),
+    'Modalidad': pd.CategoricalDtype(MODALIDADES), 'Tipo_Traslado': pd.CategoricalDtype(TIPOS_TRASLADO),
+    'Reempaque': 'bool', 'Abonado': 'float64', 'Fecha_Registro': 'datetime64[ns]', 'Tarifa_Version': 'str',
+}
+
+def _marco_tipado(registros):
+    df = pd.DataFrame(list(registros), columns=list(ESQUEMA_MARCO))
+    for col, tipo in ESQUEMA_MARCO.items():
+        if tipo == 'str': df[col] = df[col].fillna('').astype(str)
+        elif tipo == 'bool': df[col] = df[col].eq(True)
+        elif tipo == 'float64': df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        elif tipo == 'datetime64[ns]': df[col] = pd.to_datetime(df[col], errors='coerce')
+        else: df[col] = pd.Categorical(df[col], dtype=tipo)
+    return df.set_index('ID_Barra', drop=False).rename_axis(None)
+
+# --- Índice de búsqueda ---
+# Trigramas para subcadenas de 3+ caracteres y caracteres/bigramas para consultas de 1-2 caracteres
+# (subcadena en cualquier posición, no solo prefijo). Se mantiene por diferencia en cada
+# alta/edición/baja del Inventario. Con `limite` solo se ordenan los k mejores (heapq).
+class IndiceBusqueda:
+    CAMPOS = ('ID_Barra', 'Cliente', 'Correo')
+
+    def __init__(self):
+        self._gramas, self._cortos, self._textos = {}, {}, {}
+
+    @staticmethod
+    def _trigramas(texto): return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+    @staticmethod
+    def _bigramas(texto): return {texto[i:i + n] for n in (1, 2) for i in range(len(texto) - n + 1)}
+
+    def _llaves(self, textos):
+        gramas, cortos = set(), set()
+        for t in textos: gramas |= self._trigramas(t); cortos |= self._bigramas(t)
+        return gramas, cortos
+
+    def indexar(self, reg):
+        i = reg['ID_Barra']
+        textos = tuple(str(reg.get(c) or '').lower() for c in self.CAMPOS)
+        if self._textos.get(i) == textos: return
+        if i in self._textos: self.eliminar(i)
+        self._textos[i] = textos
+        gramas, cortos = self._llaves(textos)
+        for g in gramas: self._gramas.setdefault(g, set()).add(i)
+        for g in cortos: self._cortos.setdefault(g, set()).add(i)
+
+    def eliminar(self, i):
+        textos = self._textos.pop(i, None)
+        if textos is None: return
+        gramas, cortos = self._llaves(textos)
+        for dic, llaves in ((self._gramas, gramas), (self._cortos, cortos)):
+            for g in llaves:
+                dic[g].discard(i)
+                if not dic[g]: del dic[g]
+
+    def buscar(self, consulta, campos=CAMPOS, limite=None, aceptar=None):
+        """IDs que contienen `consulta` en alguno de `campos`, ordenados por exacto > prefijo > subcadena.
+        `aceptar(id)` filtra candidatos antes de ordenar (filtros de Estado, Correo…)."""
+        q = consulta.lower().strip()
+        if not q: return []
+        if len(q) >= 3:
+            conjuntos = sorted((self._gramas.get(g, set()) for g in self._trigramas(q)), key=len)
+            candidatos = set(conjuntos[0]).intersection(*conjuntos[1:]) if conjuntos[0] else set()
+        else: candidatos = self._cortos.get(q, set())
+        pos = [self.CAMPOS.index(c) for c in campos]
+        def rangos():
+            for i in candidatos:
+                textos = self._textos[i]
+                rango = min((0 if textos[k] == q else 1 if textos[k].startswith(q) else 2 for k in pos if q in textos[k]), default=None)
+                if rango is not None and (aceptar is None or aceptar(i)): yield rango, i
+        ranking = heapq.nsmallest(limite, rangos()) if limite else sorted(rangos())
+        return [i for _, i in ranking]
+
+def _cumple(reg, iguales, distintos):
+    return (all(_clave_indice(reg, c) == _clave_indice({c: v}, c) for c, v in iguales.items())
+            and all(_clave_indice(reg, c) != _clave_indice({c: v}, c) for c, v in distintos.items()))
+
+class Inventario:
+    """Contenedor de paquetes con mapa ID_Barra -> registro e índices secundarios mantenidos en cada cambio."""
+    CAMPOS_INDICE = ('Correo', 'Estado', 'Pago', 'Validado')
+
+    def __init__(self, registros=()):
+        self._por_id, self._pos, self._claves = {}, {}, {}
+        self._indices = {c: {} for c in self.CAMPOS_INDICE}  # valor -> {ID_Barra: None} (conjunto ordenado)
+        self._siguiente = 0
+        # Cambios pendientes de volcar al marco columnar; el marco se construye una vez y luego se parchea.
+        self._marco, self._insertados, self._actualizados, self._eliminados = None, [], set(), set()
+        self._pagos, self._version, self._version_pagos = None, 0, -1
+        self.busqueda = IndiceBusqueda()
+        # Alertas materializadas (conjuntos ordenados de ID_Barra). La morosidad se recalcula de forma
+        # vectorizada una vez al día (al cambiar _corte) y entre tanto se mantiene en cada cambio.
+        self._discrepancias, self._morosos, self._corte = {}, {}, None
+        for r in registros: self.agregar(r)
+
+    def __len__(self): return len(self._por_id)
+    def __iter__(self): return iter(list(self._por_id.values()))
+    def __contains__(self, id_barra): return id_barra in self._por_id
+    def ids(self): return list(self._por_id)
+    def por_id(self, id_barra): return self._por_id.get(id_barra)
+    def contar(self, campo, valor): return len(self._indices[campo].get(valor, ()))
+
+    def _indexar(self, reg):
+        i = reg['ID_Barra']
+        claves = tuple(_clave_indice(reg, c) for c in self.CAMPOS_INDICE)
+        for c, v in zip(self.CAMPOS_INDICE, claves): self._indices[c].setdefault(v, {})[i] = None
+        self._claves[i] = claves
+
+    def _desindexar(self, i):
+        # Se usan las claves con que se indexó: los registros pueden haberse mutado in situ antes del cambio.
+        for c, v in zip(self.CAMPOS_INDICE, self._claves.pop(i)):
+            cubeta = self._indices[c][v]
+            del cubeta[i]
+            if not cubeta: del self._indices[c][v]
+
+    def agregar(self, reg):
+        i = reg['ID_Barra']
+        if i in self._por_id: return self.actualizar(reg)
+        self._por_id[i], self._pos[i] = reg, self._siguiente
+        self._siguiente += 1
+        self._indexar(reg)
+        self.busqueda.indexar(reg)
+        self._evaluar_alertas(reg)
+        self._version += 1
+        if self._marco is not None: self._insertados.append(i)
+
+    def actualizar(self, reg):
+        i = reg['ID_Barra']
+        if i not in self._por_id: return self.agregar(reg)
+        self._desindexar(i)
+        self._por_id[i] = reg
+        self._indexar(reg)
+        self.busqueda.indexar(reg)
+        self._evaluar_alertas(reg)
+        self._version += 1
+        if self._marco is not None: self._actualizados.add(i)
+
+    def eliminar(self, id_barra):
+        if id_barra not in self._por_id: return None
+        self._desindexar(id_barra)
+        self.busqueda.eliminar(id_barra)
+        self._discrepancias.pop(id_barra, None); self._morosos.pop(id_barra, None)
+        del self._pos[id_barra]
+        self._version += 1
+        if self._marco is not None: self._eliminados.add(id_barra)
+        return self._por_id.pop(id_barra)
+
+    def _evaluar_alertas(self, reg):
+        i = reg['ID_Barra']
+        try: variacion = abs(float(reg.get('Peso_Mensajero') or 0) - float(reg.get('Peso_Almacen') or 0))
+        except (TypeError, ValueError): variacion = 0.0
+        if reg.get('Validado') and variacion > UMBRAL_VARIACION: self._discrepancias[i] = None
+        else: self._discrepancias.pop(i, None)
+        if self._corte is None: return
+        fecha = reg.get('Fecha_Registro')
+        if reg.get('Pago') != 'PAGADO' and pd.notna(fecha) and pd.Timestamp(fecha) < self._corte: self._morosos[i] = None
+        else: self._morosos.pop(i, None)
+
+    def alertas(self):
+        """(discrepancias, morosos): listas de ID_Barra con variación de peso y con pago vencido."""
+        # Fecha anterior a la medianoche de hace DIAS_MOROSIDAD + 1 días: lleva con certeza más de
+        # DIAS_MOROSIDAD días completos, como el '(hoy - fecha).days > N' del aviso de la pestaña.
+        corte = pd.Timestamp(datetime.now().date()) - pd.Timedelta(days=DIAS_MOROSIDAD + 1)
+        if corte != self._corte:
+            m = self.marco()
+            self._morosos = dict.fromkeys(m.index[(m['Pago'] != 'PAGADO') & (m['Fecha_Registro'] < corte)])
+            self._corte = corte
+        return list(self._discrepancias), list(self._morosos)
+
+    def actualizar_montos(self, ids, montos, version):
+        """Cambia Monto_USD y Tarifa_Version en bloque. Los índices no dependen del monto; solo se reindexan
+        los paquetes que con el nuevo monto quedan saldados (misma regla que COBROS) y pasan a PAGADO."""
+        registros, saldados = [], []
+        for i, monto in zip(ids, montos):
+            r = self._por_id[i]
+            r['Monto_USD'], r['Tarifa_Version'], r['Version'] = float(monto), version, version_registro(r) + 1
+            if r.get('Pago') != 'PAGADO' and r['Monto_USD'] - float(r.get('Abonado') or 0) <= 0.01:
+                self._desindexar(i)
+                r['Pago'] = 'PAGADO'
+                self._indexar(r)
+                self._evaluar_alertas(r)
+                saldados.append(i)
+            registros.append(r)
+        if self._marco is not None and registros:
+            self._marco.loc[ids, 'Monto_USD'] = montos
+            self._marco.loc[ids, 'Tarifa_Version'] = version
+            if saldados: self._marco.loc[saldados, 'Pago'] = 'PAGADO'
+        self._version += 1
+        return registros
+
+    def marco(self):
+        """DataFrame tipado del contenido, indexado por ID_Barra. No debe mutarse desde fuera."""
+        if self._marco is None:
+            self._marco = _marco_tipado(self._por_id.values())
+            return self._marco
+        if not (self._insertados or self._actualizados or self._eliminados): return self._marco
+        m = self._marco
+        ins = [i for i in dict.fromkeys(self._insertados) if i in self._por_id]
+        ya = set(ins)
+        upd = [i for i in self._actualizados if i in self._por_id and i not in ya and i not in self._eliminados]
+        borrar = [i for i in self._eliminados if i in m.index]
+        if borrar: m = m.drop(index=borrar)
+        if upd:
+            nuevo = _marco_tipado(self._por_id[i] for i in upd)
+            for col in ESQUEMA_MARCO: m.loc[upd, col] = nuevo[col].to_numpy()
+        if ins: m = pd.concat([m, _marco_tipado(self._por_id[i] for i in ins)])
+        self._marco, self._insertados, self._actualizados, self._eliminados = m, [], set(), set()
+        return m
+
+    def pagos(self):
+        """Historial_Pagos desplegado como tabla (una fila por abono), reconstruida solo si hubo cambios."""
+        if self._version_pagos != self._version:
+            self._pagos = _desplegar_pagos(self._por_id.items())
+            self._version_pagos = self._version
+        return self._pagos
+
+    def consultar(self, iguales=None, distintos=None):
+        iguales, distintos = dict(iguales or {}), dict(distintos or {})
+        if 'ID_Barra' in iguales:
+            r = self._por_id.get(iguales.pop('ID_Barra'))
+            candidatos = [r] if r is not None else []
+        else:
+            cubetas = [self._indices[c].get(_clave_indice({c: v}, c), {}) for c, v in iguales.items() if c in self._indices]
+            if cubetas: candidatos = [self._por_id[i] for i in min(cubetas, key=len)]
+            elif any(c in self._indices for c in distintos):
+                c = next(c for c in distintos if c in self._indices)
+                ids = [i for v, cubeta in self._indices[c].items() if v != _clave_indice({c: distintos[c]}, c) for i in cubeta]
+                candidatos = [self._por_id[i] for i in sorted(ids, key=self._pos.__getitem__)]
+            else: candidatos = list(self._por_id.values())
+        return [r for r in candidatos if _cumple(r, iguales, distintos)]
+
+    def _filtro_indexado(self, iguales, distintos):
+        # Un único filtro sobre una columna indexada: (columna, clave, es_igualdad); si no, None.
+        filtros = [(c, v, True) for c, v in iguales.items()] + [(c, v, False) for c, v in distintos.items()]
+        if len(filtros) != 1 or filtros[0][0] not in self._indices: return None
+        c, v, igual = filtros[0]
+        return c, _clave_indice({c: v}, c), igual
+
+    def contar_filtro(self, iguales=None, distintos=None):
+        """Número de coincidencias; con un solo filtro indexado sale del tamaño de la cubeta, en O(1)."""
+        iguales, distintos = dict(iguales or {}), dict(distintos or {})
+        if (f := self._filtro_indexado(iguales, distintos)):
+            n = self.contar(f[0], f[1])
+            return n if f[2] else len(self) - n
+        return len(self.consultar(iguales, distintos))
+
+    def pagina(self, ini, fin, iguales=None, distintos=None):
+        """Coincidencias [ini, fin) en orden de inserción, recorriendo solo hasta `fin` sin materializar el resto."""
+        iguales, distintos = dict(iguales or {}), dict(distintos or {})
+        if (f := self._filtro_indexado(iguales, distintos)) and f[2]:
+            fuente = (self._por_id[i] for i in self._indices[f[0]].get(f[1], {}))
+        else: fuente = (r for r in self._por_id.values() if _cumple(r, iguales, distintos))
+        return list(islice(fuente, ini, fin))
+
+    def buscar(self, texto, campos=IndiceBusqueda.CAMPOS, limite=None, iguales=None, distintos=None):
+        """Registros que coinciden con `texto` (ranking del índice de búsqueda) y con los filtros dados."""
+        iguales, distintos = iguales or {}, distintos or {}
+        aceptar = (lambda i: _cumple(self._por_id[i], iguales, distintos)) if iguales or distintos else None
+        return [self._por_id[i] for i in self.busqueda.buscar(texto, campos, limite, aceptar)]
+
+class AlmacenArchivos:
+    nombre = "archivos"
+    def cargar(self, archivo): return _cargar_archivo(archivo)
+    def guardar(self, datos, archivo): _guardar_archivo(datos, archivo)
+    def registrar_lote(self, datos, archivo, op, registros): _registrar_archivo(datos, archivo, op, registros)
+
+    def requiere_copia(self, archivo):
+        """Si el próximo registrar_lote de `archivo` recorrerá el contenido completo (sin diario o al compactar)."""
+        return not MODO_DIARIO or bool((info := _stat(_ruta_diario(archivo))) and info.st_size > UMBRAL_COMPACTACION)
+
+    def firma(self, archivo):
+        rutas = (archivo, _ruta_binaria(archivo), _ruta_diario(archivo), _ruta_rotado(archivo))
+        return tuple((info.st_mtime_ns, info.st_size) if (info := _stat(r)) else None for r in rutas)
+
+    def consultar(self, datos, archivo, iguales=None):
+        res = list(datos)
+        for col, val in (iguales or {}).items(): res = [r for r in res if _valor_columna(r, col) == val]
+        return res
+
+class AlmacenSQLite:
+    nombre = "sqlite"
+    TABLAS = {ARCHIVO_DB: "inventario", ARCHIVO_PAPELERA: "papelera", ARCHIVO_USUARIOS: "usuarios", ARCHIVO_NOTIF: "notificaciones"}
+
+    def __init__(self, ruta):
+        self.bloqueo = threading.Lock()
+        self.con = sqlite3.connect(ruta, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        with self.con:
+            for t in self.TABLAS.values():
+                self.con.execute(f"CREATE TABLE IF NOT EXISTS {t} (pk INTEGER PRIMARY KEY, ID_Barra TEXT UNIQUE, Correo TEXT, Estado TEXT, Pago TEXT, Validado INTEGER, Cliente TEXT, datos TEXT NOT NULL)")
+                self.con.execute(f"CREATE INDEX IF NOT EXISTS ix_{t}_Correo ON {t} (Correo)")
+                # Estado y Pago se filtran en memoria (Inventario): sus índices solo encarecían cada escritura.
+                for col in ('Estado', 'Pago'): self.con.execute(f"DROP INDEX IF EXISTS ix_{t}_{col}")
+            self.con.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+        self.migrar_desde_csv()
+
+    def migrar_desde_csv(self):
+        """Importa una sola vez los archivos existentes (snapshot CSV o Parquet + diario) a la base SQLite.
+
+        La marca 'migrado' se escribe en la misma transacción que los datos: si la importación falla, el
+        siguiente arranque la repite. Una base con datos pero sin marca (versiones previas) no se pisa."""
+        with self.bloqueo, self.con:
+            if self.con.execute("SELECT 1 FROM meta WHERE clave = 'migrado'").fetchone(): return
+            if not any(self.con.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() for t in self.TABLAS.values()):
+                for archivo, t in self.TABLAS.items():
+                    datos = _cargar_archivo(archivo)
+                    if datos: self._reemplazar(t, datos)
+            self.con.execute("INSERT INTO meta (clave, valor) VALUES ('migrado', ?)", (datetime.now().isoformat(timespec="seconds"),))
+
+    def _fila(self, reg):
+        vals = (_valor_columna(reg, c) for c in COLUMNAS_INDEXADAS)
+        return tuple(v.item() if hasattr(v, 'item') else v for v in vals) + (json.dumps(reg, default=_serializar, ensure_ascii=False),)
+
+    def _decodificar(self, filas):
+        datos = [json.loads(f[0]) for f in filas]
+        for r in datos:
+            if r.get('Fecha_Registro'): r['Fecha_Registro'] = pd.Timestamp(r['Fecha_Registro'])
+        return datos
+
+    def cargar(self, archivo):
+        with self.bloqueo: return self._decodificar(self.con.execute(f"SELECT datos FROM {self.TABLAS[archivo]} ORDER BY pk").fetchall())
+
+    def _reemplazar(self, t, datos):
+        # Sin commit propio: lo hace la transacción del llamador.
+        self.con.execute(f"DELETE FROM {t}")
+        filas = [self._fila(r) for r in datos]
+        self.con.executemany(f"INSERT INTO {t} ({', '.join(COLUMNAS_INDEXADAS)}, datos) VALUES (?, ?, ?, ?, ?, ?, ?)", filas)
+        return filas
+
+    def guardar(self, datos, archivo):
+        with self.bloqueo, self.con: filas = self._reemplazar(self.TABLAS[archivo], datos)
+        if METRICAS_ACTIVAS: contar('bytes_escritos', sum(len(f[-1]) for f in filas))
+
+    def firma(self, archivo):
+        # data_version cambia cuando otra conexión (otro proceso) confirma una transacción.
+        with self.bloqueo: return self.con.execute("PRAGMA data_version").fetchone()[0]
+
+    def requiere_copia(self, archivo): return False
+
+    def registrar_lote(self, datos, archivo, op, registros):
+        t = self.TABLAS[archivo]
+        filas = [] if op == 'delete' else [self._fila(r) for r in registros]
+        with self.bloqueo, self.con:
+            if op == 'delete': self.con.executemany(f"DELETE FROM {t} WHERE ID_Barra = ?", [(r['ID_Barra'],) for r in registros])
+            elif op == 'append': self.con.executemany(f"INSERT INTO {t} ({', '.join(COLUMNAS_INDEXADAS)}, datos) VALUES (?, ?, ?, ?, ?, ?, ?)", filas)
+            else:
+                sets = ", ".join(f"{c} = excluded.{c}" for c in COLUMNAS_INDEXADAS[1:] + ('datos',))
+                self.con.executemany(f"INSERT INTO {t} ({', '.join(COLUMNAS_INDEXADAS)}, datos) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(ID_Barra) DO UPDATE SET {sets}", filas)
+        if METRICAS_ACTIVAS: contar('bytes_escritos', sum(len(f[-1]) for f in filas))
+
+    def consultar(self, datos, archivo, iguales=None):
+        where, params = [], []
+        for col, val in (iguales or {}).items():
+            # El nombre de columna va en el SQL: solo se aceptan las columnas de la tabla.
+            if col not in COLUMNAS_INDEXADAS: raise ValueError(f"Columna no consultable: {col}")
+            where.append(f"{col} = ?"); params.append(val)
+        sql = f"SELECT datos FROM {self.TABLAS[archivo]}" + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY pk"
+        with self.bloqueo: return self._decodificar(self.con.execute(sql, params).fetchall())
+
+@st.cache_resource
+def crear_almacen(backend, ruta_sqlite):
+    return AlmacenSQLite(ruta_sqlite) if backend == "sqlite" else AlmacenArchivos()
+
+ALMACEN = crear_almacen(os.environ.get("IACARGO_BACKEND", "archivos"), os.environ.get("IACARGO_SQLITE", "iacargo.db"))
+
+@medido("datos.cargar")
+def cargar_datos(archivo):
+    datos = ALMACEN.cargar(archivo)
+    for r in datos:
+        if 'Version' in r: r['Version'] = version_registro(r)
+    contar('filas_cargadas', len(datos))
+    return datos
+
+@medido("datos.guardar")
+def guardar_datos(datos, archivo): ALMACEN.guardar(datos, archivo)
+
+@medido("datos.registrar_lote")
+def registrar_lote(datos, archivo, op, registros):
+    """Persiste varios cambios de la misma operación en una sola escritura (una línea de diario por registro o una transacción)."""
+    if registros: ALMACEN.registrar_lote(datos, archivo, op, registros)
+
+# --- Avisos ---
+# Búfer circular por destinatario con los últimos RETENCION_AVISOS avisos: la campana lee "los 5
+# más recientes" sin recorrer el resto. Los avisos se anexan al almacén y cada
+# COMPACTAR_AVISOS_CADA altas el snapshot se reescribe solo con lo retenido.
+RETENCION_AVISOS = int(os.environ.get("IACARGO_RETENCION_AVISOS", 50))
+COMPACTAR_AVISOS_CADA = int(os.environ.get("IACARGO_COMPACTAR_AVISOS_CADA", 500))
+
+class BuzonNotificaciones:
+    def __init__(self, avisos=()):
+        self._por_destino, self._seq, self.pendientes = {}, 0, 0
+        avisos = list(avisos)
+        # Formato antiguo (solo "hora", más reciente primero): se invierte y se marca con fecha vacía.
+        legado = [n for n in avisos if 'fecha' not in n]
+        for n in reversed(legado):
+            n['fecha'] = None
+            self._agregar(n)
+        ids_legado = set(map(id, legado))
+        for n in avisos:
+            if id(n) not in ids_legado: self._agregar(n)
+
+    def _agregar(self, aviso):
+        self._seq += 1
+        self._por_destino.setdefault(aviso.get('para'), deque(maxlen=RETENCION_AVISOS)).append((self._seq, aviso))
+
+    def publicar(self, aviso):
+        self._agregar(aviso)
+        self.pendientes += 1
+
+    def requiere_compactacion(self): return self.pendientes >= COMPACTAR_AVISOS_CADA
+    def ultimos(self, para, k=5): return [n for _, n in islice(reversed(self._por_destino.get(para, ())), k)]
+    def __len__(self): return sum(map(len, self._por_destino.values()))
+    def __iter__(self): return iter([n for _, n in heapq.merge(*self._por_destino.values(), key=lambda e: e[0])])
+
+def formatear_hora_aviso(aviso):
+    if isinstance(aviso.get('fecha'), str): return datetime.strptime(aviso['fecha'], "%Y-%m-%d %H:%M:%S").strftime("%d/%m %H:%M")
+    return aviso.get('hora', '')
+
+# --- Almacén compartido del proceso ---
+# Una sola copia de inventario, papelera, usuarios y notificaciones para todas las sesiones; cada
+# sesión guarda solo su estado de interfaz. Se recarga cuando la firma del backend cambia por una
+# escritura externa (mtime/tamaño de los archivos o data_version de SQLite). Inventario y papelera se
+# guardan como Inventario para que las búsquedas por ID y por índice sean O(1).
+CLAVES_INVENTARIO = ('inventario', 'papelera')
+
+class DatosCompartidos:
+    def __init__(self):
+        self.bloqueo = threading.RLock()
+        self.version = 0
+        self._datos, self._firmas = {}, {}
+
+    def obtener(self, clave):
+        archivo = ARCHIVOS[clave]
+        with self.bloqueo:
+            # Con escrituras en cola la copia en memoria va por delante del disco: no se recarga hasta vaciarla.
+            if clave not in self._datos or (ALMACEN.firma(archivo) != self._firmas.get(clave) and not ESCRITOR.pendiente(clave)):
+                datos = cargar_datos(archivo)
+                if clave in CLAVES_INVENTARIO: datos = Inventario(datos)
+                elif clave == 'notificaciones': datos = BuzonNotificaciones(datos)
+                self._datos[clave] = datos
+                self._firmas[clave] = ALMACEN.firma(archivo)
+                self.version += 1
+            return self._datos[clave]
+
+    def descartar(self, clave):
+        """Olvida la copia de `clave` (p. ej. tras importar): el próximo obtener la recarga del backend."""
+        with self.bloqueo:
+            self._datos.pop(clave, None)
+            self.version += 1
+
+    def marcar_escrito(self, clave):
+        # Escritura propia: ya está en memoria, así que se adopta la firma nueva sin recargar.
+        with self.bloqueo:
+            self._firmas[clave] = ALMACEN.firma(ARCHIVOS[clave])
+            self.version += 1
+
+@st.cache_resource
+def datos_compartidos(): return DatosCompartidos()
+
+@medido("datos.consultar")
+def consultar_datos(clave, iguales=None, distintos=None, texto=None, campos_texto=('ID_Barra', 'Cliente'), limite=None):
+    if clave in CLAVES_INVENTARIO:
+        # Paquetes: siempre desde el Inventario compartido, que es la copia autoritativa (el backend
+        # recibe los cambios de ESCRITOR con retraso) y resuelve filtros y texto con sus índices.
+        with DATOS.bloqueo:
+            inv = DATOS.obtener(clave)
+            res = inv.buscar(texto, campos_texto, limite, iguales, distintos) if texto else inv.consultar(iguales, distintos)
+    else:
+        if distintos or texto: raise ValueError(f"'{clave}' solo admite filtros de igualdad")
+        if ESCRITOR.pendiente(clave): ESCRITOR.esperar()
+        res = ALMACEN.consultar(DATOS.obtener(clave), ARCHIVOS[clave], iguales)
+    if limite: res = res[:limite]
+    contar('filas_leidas', len(res))
+    return res
+
+def contar_datos(clave, iguales=None, distintos=None):
+    with DATOS.bloqueo: return DATOS.obtener(clave).contar_filtro(iguales, distintos)
+
+def pagina_datos(clave, ini, fin, iguales=None, distintos=None):
+    """Solo las filas [ini, fin) de paquetes que cumplen el filtro (inventario o papelera)."""
+    with DATOS.bloqueo: res = DATOS.obtener(clave).pagina(ini, fin, iguales, distintos)
+    contar('filas_leidas', len(res))
+    return res
+
+def alertas_inventario():
+    with DATOS.bloqueo: return DATOS.obtener('inventario').alertas()
+
+@medido("datos.marco")
+def marco_inventario(clave='inventario'):
+    with DATOS.bloqueo: m = DATOS.obtener(clave).marco()
+    contar('filas_leidas', len(m))
+    return m
+
+def listar_ids(clave, **filtros): return [p['ID_Barra'] for p in consultar_datos(clave, **filtros)]
+
+# --- Escritor en segundo plano ---
+# Las sesiones aplican sus cambios en memoria y los encolan; un único hilo los junta durante
+# VENTANA_GRUPO y los persiste en un solo commit de grupo (una escritura por clave y operación
+# consecutivas). Cada encolado devuelve un ticket; `confirmado` avanza cuando el lote está en disco.
+VENTANA_GRUPO = float(os.environ.get("IACARGO_VENTANA_GRUPO", 0.05))
+MAX_LOTE_GRUPO = 1000
+
+class EscritorGrupal:
+    def __init__(self):
+        self.cola = queue.Queue()
+        self.condicion = threading.Condition()
+        self.encolados = self.confirmado = 0
+        self.error = None      # último fallo, para el admin; se limpia con el siguiente commit sin errores
+        self.fallidos = {}     # ticket -> motivo, para avisar solo a la sesión que encoló ese cambio
+        self._pendientes = {}
+        threading.Thread(target=self._bucle, name="iacargo-escritor", daemon=True).start()
+
+    def encolar(self, clave, op, registros):
+        # Se llama con DATOS.bloqueo tomado: el orden de la cola es el orden en que se aplicó en memoria.
+        with self.condicion:
+            self.encolados += 1
+            self._pendientes[clave] = self._pendientes.get(clave, 0) + 1
+            self.cola.put((self.encolados, clave, op, [dict(r) for r in registros]))
+            return self.encolados
+
+    def pendiente(self, clave): return self._pendientes.get(clave, 0) > 0
+
+    def esperar(self, ticket=None, timeout=None):
+        """Bloquea hasta que `ticket` (por defecto, todo lo encolado) esté en disco."""
+        with self.condicion:
+            objetivo = self.encolados if ticket is None else ticket
+            return self.condicion.wait_for(lambda: self.confirmado >= objetivo, timeout)
+
+    def detener(self):
+        """Escribe lo encolado y termina el hilo (p. ej. antes de descartar la caché en benchmark.py)."""
+        self.esperar()
+        self.cola.put(None)
+
+    def _bucle(self):
+        while (primero := self.cola.get()) is not None:
+            lote = [primero]
+            time.sleep(VENTANA_GRUPO)
+            while len(lote) < MAX_LOTE_GRUPO:
+                try: lote.append(self.cola.get_nowait())
+                except queue.Empty: break
+            self._escribir(lote)
+
+    @medido("escritor.commit_grupo")
+    def _escribir(self, lote):
+        # Con DATOS.bloqueo solo se copia: nadie puede encolar mientras tanto, así que al vaciar la cola en
+        # este lote las copias completas coinciden exactamente con lo que queda escrito. El disco se toca
+        # después, sin el cerrojo, y las copias se usan solo en el último grupo de cada clave (un snapshot
+        # o compactado antes de los grupos siguientes volvería a anexar sus cambios en el diario nuevo).
+        with DATOS.bloqueo:
+            while True:
+                try: lote.append(self.cola.get_nowait())
+                except queue.Empty: break
+            copias, avisos = {}, set()
+            for clave in dict.fromkeys(c for _, c, _, _ in lote):
+                datos = DATOS.obtener(clave)
+                if hasattr(datos, 'requiere_compactacion') and datos.requiere_compactacion():
+                    avisos.add(clave); datos.pendientes = 0
+                if clave in avisos or ALMACEN.requiere_copia(ARCHIVOS[clave]): copias[clave] = [dict(r) for r in datos]
+        contar('commits_grupo'); contar('cambios_encolados', len(lote))
+        grupos = []
+        for ticket, clave, op, registros in lote:
+            if grupos and grupos[-1][:2] == (clave, op): grupos[-1][2].extend(registros); grupos[-1][3].append(ticket)
+            else: grupos.append((clave, op, list(registros), [ticket]))
+        ultimo = {clave: n for n, (clave, _, _, _) in enumerate(grupos)}
+        fallidos = {}
+        for n, (clave, op, registros, tickets) in enumerate(grupos):
+            archivo, copia = ARCHIVOS[clave], copias.get(clave) if ultimo[clave] == n else None
+            try:
+                registrar_lote(copia, archivo, op, registros)
+                # Retención: el snapshot se reescribe solo con los últimos RETENCION_AVISOS de cada destinatario.
+                if clave in avisos and copia is not None: guardar_datos(copia, archivo)
+            except Exception as e:
+                # La copia en memoria tiene el cambio: se intenta un snapshot completo antes de reportar.
+                try:
+                    if copia is None:
+                        with DATOS.bloqueo: copia = [dict(r) for r in DATOS.obtener(clave)]
+                    guardar_datos(copia, archivo)
+                except Exception: fallidos.update(dict.fromkeys(tickets, f"{clave}: {e}"))
+        for clave in ultimo:
+            # El diario puede cruzar el umbral con este mismo grupo: se compacta ya si no hay cambios de la
+            # clave en cola (la copia tomada con el cerrojo coincide entonces con lo anexado); si los hay,
+            # el grupo siguiente ve el tamaño en requiere_copia y compacta con su copia.
+            if clave not in copias and ALMACEN.requiere_copia(ARCHIVOS[clave]):
+                with DATOS.bloqueo:
+                    if all(c != clave for _, c, _, _ in list(self.cola.queue)): compactar_datos(DATOS.obtener(clave), ARCHIVOS[clave])
+            DATOS.marcar_escrito(clave)
+        with self.condicion:
+            for _, clave, _, _ in lote: self._pendientes[clave] -= 1
+            self.confirmado = lote[-1][0]
+            if fallidos: self.fallidos.update(fallidos); self.error = fallidos[max(fallidos)]
+            else: self.fallidos.clear(); self.error = None
+            self.condicion.notify_all()
+
+    def fallo(self, ticket): return self.fallidos.get(ticket)
+
+@st.cache_resource
+def escritor_grupal(): return EscritorGrupal()
+
+class ConflictoVersion(Exception):
+    """Otra sesión cambió el registro (su Version) desde que se mostró en pantalla."""
+
+class IDDuplicado(Exception):
+    """Alta de un ID_Barra que ya está en inventario o papelera (p. ej. dos sesiones registrando el mismo ID)."""
+
+def aplicar_cambio(clave, op, registro, esperada=None, traslado=False):
+    """Aplica el cambio a la copia compartida de `clave` y lo encola para persistirlo por el backend activo."""
+    return aplicar_lote(clave, op, [registro], None if esperada is None else {registro['ID_Barra']: esperada}, traslado)
+
+def importar_respaldo(clave, origen):
+    """Reemplaza el contenido de `clave` con un CSV (ruta o archivo subido) y recarga la copia compartida."""
+    ESCRITOR.esperar()  # lo encolado antes de importar queda escrito y luego reemplazado, no después
+    with DATOS.bloqueo:
+        datos = importar_csv(ARCHIVOS[clave], origen)
+        DATOS.descartar(clave)
+        if clave in CLAVES_INVENTARIO: ASIGNADOR.marcar(r['ID_Barra'] for r in datos if r.get('ID_Barra'))
+    return datos
+
+@medido("datos.aplicar_lote")
+def aplicar_lote(clave, op, registros, esperadas=None, traslado=False):
+    """`esperadas` ({ID_Barra: Version}) activa el control optimista: si alguna no coincide se lanza ConflictoVersion.
+    Un alta de un ID ya presente en inventario o papelera lanza IDDuplicado; con `traslado` (restaurar desde
+    la papelera) solo cuenta la clave destino, porque el ID sale de la otra en la misma operación."""
+    with DATOS.bloqueo:
+        datos = DATOS.obtener(clave)
+        conflictos = [i for i, v in (esperadas or {}).items() if (actual := datos.por_id(i)) is None or version_registro(actual) != v]
+        if conflictos: raise ConflictoVersion(conflictos)
+        if op == 'insert' and clave in CLAVES_INVENTARIO:
+            fuentes = [datos] if traslado else [DATOS.obtener(c) for c in CLAVES_INVENTARIO]
+            repetidos = [r['ID_Barra'] for r in registros if any(r['ID_Barra'] in f for f in fuentes)]
+            if repetidos: raise IDDuplicado(repetidos)
+        for r in registros:
+            if op != 'delete': r['Version'] = version_registro(datos.por_id(r['ID_Barra']) or r) + 1
+            if op == 'insert': datos.agregar(r)
+            elif op == 'delete': datos.eliminar(r['ID_Barra'])
+            else: datos.actualizar(r)  # con SQLite las consultas devuelven copias: se reemplaza por ID
+        if op == 'insert': ASIGNADOR.marcar(r['ID_Barra'] for r in registros)
+        ticket = ESCRITOR.encolar(clave, op, registros)
+    st.session_state.ticket_escritura = ticket
+    return ticket
+
 def hash_password(password): return hashlib.sha256(str.encode(password)).hexdigest()
-def generar_id_unico(): return f"IAC-{''.join(random.choices(string.ascii_uppercase + string.digits, k=6))}"
 def obtener_icono_transporte(tipo): return {"Aéreo": "✈️", "Marítimo": "🚢", "Envio Nacional": "🚚"}.get(tipo, "📦")
 
+# --- Asignador de IDs ---
+# Conjunto con todos los ID_Barra emitidos: inventario, papelera y ARCHIVO_IDS (append-only, sobrevive a
+# reinicios y bajas definitivas). Los IDs nuevos se sortean por bloques de TAMANO_BLOQUE_IDS, que se
+# anotan en el archivo de una sola vez antes de repartirse desde memoria: O(1) por ID, sin recorrer datos.
+ARCHIVO_IDS = "ids_emitidos_iacargo.txt"
+TAMANO_BLOQUE_IDS = int(os.environ.get("IACARGO_BLOQUE_IDS", 256))
+ALFABETO_IDS = string.ascii_uppercase + string.digits
+
+class AsignadorIDs:
+    def __init__(self, ruta=ARCHIVO_IDS):
+        self.ruta = ruta
+        self._emitidos, self._libres, self._leido = None, deque(), 0
+
+    def _sincronizar(self):
+        # La primera vez se parte de inventario y papelera; después solo se lee lo anexado al archivo
+        # desde la última lectura (bloques propios o de otro proceso con el mismo directorio).
+        if self._emitidos is None: self._emitidos = set(DATOS.obtener('inventario').ids()) | set(DATOS.obtener('papelera').ids())
+        if (info := _stat(self.ruta)) and info.st_size > self._leido:
+            with open(self.ruta, "rb") as f:
+                f.seek(self._leido)
+                nuevo = f.read()
+            completo = nuevo[:nuevo.rfind(b"\n") + 1]
+            self._emitidos.update(completo.decode("utf-8").split())
+            self._leido += len(completo)
+
+    def _anotar(self, ids):
+        with open(self.ruta, "ab") as f: f.write("".join(f"{i}\n" for i in ids).encode("utf-8"))
+
+    def _sortear(self, n):
+        nuevos = []
+        while len(nuevos) < n:
+            i = f"IAC-{''.join(random.choices(ALFABETO_IDS, k=6))}"
+            if i not in self._emitidos:
+                self._emitidos.add(i); nuevos.append(i)
+        return nuevos
+
+    def reservar(self, n):
+        """Devuelve n IDs nunca emitidos, tomados del bloque en curso (se sortea otro al agotarse)."""
+        with DATOS.bloqueo:
+            self._sincronizar()
+            if len(self._libres) < n:
+                bloque = self._sortear(max(TAMANO_BLOQUE_IDS, n - len(self._libres)))
+                self._anotar(bloque)
+                self._libres.extend(bloque)
+            return [self._libres.popleft() for _ in range(n)]
+
+    def siguiente(self): return self.reservar(1)[0]
+
+    def emitidos(self, ids):
+        """Para cada ID, si ya fue emitido o anotado (incluidos los reservados que aún no se usaron)."""
+        with DATOS.bloqueo:
+            self._sincronizar()
+            return [i in self._emitidos for i in ids]
+
+    def marcar(self, ids):
+        """Anota IDs que entran por otra vía (escritos a mano o escaneados) para que no se vuelvan a emitir."""
+        with DATOS.bloqueo:
+            self._sincronizar()
+            nuevos = [i for i in dict.fromkeys(ids) if i not in self._emitidos]
+            if nuevos:
+                self._emitidos.update(nuevos)
+                self._anotar(nuevos)
+
+@st.cache_resource
+def asignador_ids(): return AsignadorIDs()
+
+def generar_id_unico(): return ASIGNADOR.siguiente()
+
 # --- Session State ---
-for key, file in [('inventario', ARCHIVO_DB), ('papelera', ARCHIVO_PAPELERA), ('usuarios', ARCHIVO_USUARIOS), ('notificaciones', ARCHIVO_NOTIF)]:
-    if key not in st.session_state: st.session_state[key] = cargar_datos(file)
+DATOS = datos_compartidos()
+ESCRITOR = escritor_grupal()
+ASIGNADOR = asignador_ids()
 
 if 'usuario_identificado' not in st.session_state: st.session_state.usuario_identificado = None
 if 'id_actual' not in st.session_state: st.session_state.id_actual = generar_id_unico()
 if 'landing_vista' not in st.session_state: st.session_state.landing_vista = True
+if METRICAS_ACTIVAS:
+    st.session_state.reruns = st.session_state.get('reruns', 0) + 1
+    contar('reruns')
 
 # --- 3. DASHBOARDS ADMIN ---
-def render_admin_dashboard():
-    st.markdown('<div class="welcome-text">Consola de Control Logístico</div>', unsafe_allow_html=True)
-    tabs = st.tabs(["📥 REGISTRO", "⚖️ VALIDACIÓN", "💰 COBROS", "📍 ESTADOS", "🔍 AUDITORÍA", "📊 RESUMEN", "🚨 ALERTAS"])
-    t_reg, t_val, t_cob, t_est, t_aud, t_res, t_ale = tabs
-
-    with t_reg:
-        st.subheader("Registro de Entrada")
-        f_tra = st.selectbox("Tipo de Traslado", ["Aéreo", "Marítimo", "Envio Nacional"])
-        label_din = "Pies Cúbicos (ft³)" if f_tra == "Marítimo" else "Peso (Kilogramos)"
-        with st.form("reg_form"):
-            col1, col2 = st.columns(2)
-            f_id = col1.text_input("ID Tracking / Guía", value=st.session_state.id_actual)
-            f_cli = col2.text_input("Nombre del Cliente")
-            f_cor = col1.text_input("Correo del Cliente")
-            f_pes = col2.number_input(label_din, min_value=0.0, step=0.1)
-            f_mod = st.selectbox("Modalidad de Pago", ["Pago Completo", "Cobro Destino", "Pago en Cuotas"])
-            f_reemp = st.checkbox("📦 ¿Solicita Reempaque Especial? (+$5.00)")
-            if st.form_submit_button("REGISTRAR PAQUETE"):
-                if f_id and f_cli and f_cor:
-                    monto_calc = calcular_monto(f_pes, f_tra, f_reemp)
-                    nuevo = {"ID_Barra": f_id, "Cliente": f_cli, "Correo": f_cor.lower().strip(), "Peso_Mensajero": f_pes, "Peso_Almacen": 0.0, "Validado": False, "Monto_USD": monto_calc, "Estado": "RECIBIDO ALMACEN PRINCIPAL", "Pago": "PENDIENTE", "Modalidad": f_mod, "Tipo_Traslado": f_tra, "Reempaque": f_reemp, "Abonado": 0.0, "Fecha_Registro": datetime.now(), "Historial_Pagos": []}
-                    st.session_state.inventario.append(nuevo)
-                    guardar_datos(st.session_state.inventario, ARCHIVO_DB)
-                    registrar_notificacion(f_cor.lower().strip(), f"¡Hola! Hemos recibido tu paquete {f_id} en origen.")
-                    st.session_state.id_actual = generar_id_unico()
-                    st.rerun()
-
-    with t_val:
-        st.subheader("Validación de Carga")
-        pendientes = [p for p in st.session_state.inventario if not p.get('Validado')]
-        if pendientes:
-            guia_v = st.selectbox("Guía a validar:", [p["ID_Barra"] for p in pendientes])
-            paq = next(p for p in pendientes if p["ID_Barra"] == guia_v)
-            st.warning(f"Declarado por mensajero: {paq['Peso_Mensajero']} ({paq['Tipo_Traslado']})")
-            valor_real = st.number_input("Medición Real en Almacén:", min_value=0.0, value=float(paq['Peso_Mensajero']))
-            if st.button("CONFIRMAR VALIDACIÓN"):
-                paq['Peso_Almacen'] = valor_real
-                paq['Validado'] = True
-                paq['Monto_USD'] = calcular_monto(valor_real, paq['Tipo_Traslado'], paq.get('Reempaque', False))
-                guardar_datos(st.session_state.inventario, ARCHIVO_DB); st.rerun()
-
-    with t_cob:
-        st.subheader("Gestión de Cobros")
-        busq_cobro = st.text_input("🔍 Buscar paquete o cliente para cobrar:", key="sc")
-        p_pago = [p for p in st.session_state.inventario if p['Pago'] != 'PAGADO']
-        if busq_cobro:
-            p_pago = [p for p in p_pago if busq_cobro.lower() in p['ID_Barra'].lower() or busq_cobro.lower() in p['Cliente'].lower()]
-        
-        for p in p_pago:
-            rest = float(p['Monto_USD']) - float(p['Abonado'])
-            with st.expander(f"💵 {p['Cliente']} | {p['ID_Barra']} ({p.get('Modalidad', 'N/A')})"):
-                st.write(f"Deuda Total: ${rest:.2f}")
-                m_abono = st.number_input(f"Abonar a {p['ID_Barra']}:", 0.0, float(rest), float(rest), key=f"c_{p['ID_Barra']}")
-                if st.button("REGISTRAR PAGO", key=f"b_{p['ID_Barra']}"):
-                    p['Abonado'] = float(p['Abonado']) + m_abono
-                    if (float(p['Monto_USD']) - p['Abonado']) <= 0.01: p['Pago'] = 'PAGADO'
-                    guardar_datos(st.session_state.inventario, ARCHIVO_DB); st.rerun()
-
-    with t_est:
-        st.subheader("Actualizar Ubicación")
-        if st.session_state.inventario:
-            guia_est = st.selectbox("Seleccionar Guía:", [p["ID_Barra"] for p in st.session_state.inventario])
-            paq = next(p for p in st.session_state.inventario if p["ID_Barra"] == guia_est)
-            idx_st = ["RECIBIDO ALMACEN PRINCIPAL", "EN TRANSITO", "RECIBIDO EN ALMACEN DE DESTINO", "ENTREGADO"].index(paq['Estado']) if paq['Estado'] in ["RECIBIDO ALMACEN PRINCIPAL", "EN TRANSITO", "RECIBIDO EN ALMACEN DE DESTINO", "ENTREGADO"] else 0
-            n_st = st.selectbox("Nuevo Estado:", ["RECIBIDO ALMACEN PRINCIPAL", "EN TRANSITO", "RECIBIDO EN ALMACEN DE DESTINO", "ENTREGADO"], index=idx_st)
-            if st.button("ACTUALIZAR ESTATUS"):
-                paq["Estado"] = n_st
-                registrar_notificacion(paq['Correo'], f"Tu paquete {paq['ID_Barra']} está en: {n_st}")
-                guardar_datos(st.session_state.inventario, ARCHIVO_DB); st.rerun()
-
-    with t_aud:
-        st.subheader("🕵️ Auditoría y Gestión")
-        v_papelera = st.checkbox("📂 Ver Papelera de Reciclaje")
-        if v_papelera:
-            if st.session_state.papelera:
-                g_res = st.selectbox("Restaurar ID:", [p["ID_Barra"] for p in st.session_state.papelera])
-                if st.button("♻️ RESTAURAR SELECCIONADO"):
-                    paq_r = next(p for p in st.session_state.papelera if p["ID_Barra"] == g_res)
-                    st.session_state.inventario.append(paq_r)
-                    st.session_state.papelera = [p for p in st.session_state.papelera if p["ID_Barra"] != g_res]
-                    guardar_datos(st.session_state.inventario, ARCHIVO_DB); guardar_datos(st.session_state.papelera, ARCHIVO_PAPELERA); st.rerun()
-            else: st.info("Papelera vacía.")
+# Cada pestaña es un fragmento independiente: solo se ejecuta la activa y sus escrituras la
+# vuelven a ejecutar a ella sola (st.rerun(scope="fragment")), no a toda la consola.
+
+# Las listas largas (RESUMEN, COBROS) se paginan en el servidor: cada página se emite como un único
+# bloque HTML y el detalle de un paquete se carga solo cuando se selecciona.
+TAMANOS_PAGINA = [25, 50, 100, 250]
+# Las cajas de búsqueda solo ordenan y muestran los mejores LIMITE_BUSQUEDA resultados.
+LIMITE_BUSQUEDA = 250
+
+def avisar_limite(res):
+    if len(res) >= LIMITE_BUSQUEDA: st.caption(f"Mostrando los {LIMITE_BUSQUEDA} mejores resultados; afina la búsqueda para ver otros.")
+    return res
+
+def version_vista(clave, reg):
+    """Version del registro tal como se mostró en el render anterior (la que el admin tenía en pantalla)."""
+    previa = st.session_state.get(clave)
+    st.session_state[clave] = (reg['ID_Barra'], version_registro(reg))
+    return previa[1] if previa and previa[0] == reg['ID_Barra'] else version_registro(reg)
+
+def aplicar_edicion(clave, op, reg, esperada):
+    try: aplicar_cambio(clave, op, reg, esperada)
+    except ConflictoVersion:
+        st.error(f"⚠️ {reg['ID_Barra']} fue modificado por otra sesión. Revisa los datos actuales y repite la operación.")
+        return False
+    return True
+
+def aplicar_alta(clave, reg, traslado=False):
+    try: aplicar_cambio(clave, 'insert', reg, traslado=traslado)
+    except IDDuplicado:
+        st.error(f"El ID {reg['ID_Barra']} ya está registrado.")
+        return False
+    return True
+
+def paginar(total, clave):
+    """Selector de tamaño y número de página; devuelve el rango [ini, fin) de filas a mostrar."""
+    c1, c2, c3 = st.columns([1, 1, 2])
+    tam = c1.selectbox("Filas por página", TAMANOS_PAGINA, key=f"{clave}_tam")
+    paginas = max(1, -(-total // tam))
+    if st.session_state.get(f"{clave}_pag", 1) > paginas: st.session_state[f"{clave}_pag"] = paginas
+    pag = c2.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, step=1, key=f"{clave}_pag")
+    ini = (pag - 1) * tam
+    c3.caption(f"Mostrando {ini + 1}-{min(ini + tam, total)} de {total}")
+    return ini, ini + tam
+
+def _fila_resumen_html(r):
+    f_reg = r['Fecha_Registro'].strftime('%d/%m/%y') if pd.notna(r['Fecha_Registro']) else "—"
+    icon = obtener_icono_transporte(r.get('Tipo_Traslado'))
+    badge_reempaque = ' <span style="color:#a78bfa; font-size:10px; font-weight:bold;">[REEMPAQUE]</span>' if r.get("Reempaque") else ""
+    modalidad = r['Modalidad'] if isinstance(r.get('Modalidad'), str) else 'Pago Completo'
+    return (f'<div class="resumen-row"><div style="display: flex; align-items: center; gap: 15px;">'
+            f'<div style="color:#2563eb; font-weight:800; min-width:110px;">{icon} {r["ID_Barra"]}</div>'
+            f'<div style="border-left: 1px solid #cbd5e1; height: 20px;"></div>'
+            f'<div><b style="color:#1e293b;">{r["Cliente"]}</b><div style="font-size:10px; color:#64748b;">Registrado: {f_reg} | {modalidad}{badge_reempaque}</div></div></div>'
+            f'<div style="color:#64748b; font-size:12px; font-weight:700;">{r["Tipo_Traslado"]}</div></div>')
+
+def _fila_cobro_html(p):
+    rest = max(0.0, float(p['Monto_USD']) - float(p['Abonado']))
+    return (f'<div class="resumen-row"><div style="display: flex; align-items: center; gap: 15px;">'
+            f'<div style="color:#2563eb; font-weight:800; min-width:110px;">💵 {p["ID_Barra"]}</div>'
+            f'<div><b style="color:#1e293b;">{p["Cliente"]}</b><div style="font-size:10px; color:#64748b;">{p.get("Modalidad", "N/A")}</div></div></div>'
+            f'<div style="color:#dc2626; font-size:13px; font-weight:800;">${rest:.2f}</div></div>')
+
+def render_detalle_paquete(r):
+    rest_p = float(r['Monto_USD']) - float(r['Abonado'])
+    c_aud1, c_aud2 = st.columns(2)
+    with c_aud1:
+        st.write(f"**Cliente:** {r['Cliente']}")
+        st.write(f"**Correo:** {r['Correo']}")
+        st.write(f"**Modalidad:** {r.get('Modalidad', 'Pago Completo')}")
+    with c_aud2:
+        st.write(f"**Monto Total:** ${float(r['Monto_USD']):.2f}")
+        st.write(f"**Abonado:** ${float(r['Abonado']):.2f}")
+        if rest_p > 0:
+            st.error(f"**Pendiente:** ${rest_p:.2f}")
         else:
-            busq_aud = st.text_input("🔍 Buscar en historial:", key="aud_s")
-            df_aud = pd.DataFrame(st.session_state.inventario)
-            if not df_aud.empty and busq_aud:
-                df_aud = df_aud[df_aud['ID_Barra'].astype(str).str.contains(busq_aud, case=False) | df_aud['Cliente'].astype(str).str.contains(busq_aud, case=False)]
-            st.dataframe(df_aud, use_container_width=True)
-            
-            if st.session_state.inventario:
-                st.markdown("---")
-                st.subheader("📝 Editar Paquete Seleccionado")
-                g_ed = st.selectbox("ID para modificar:", [p["ID_Barra"] for p in st.session_state.inventario])
-                p_ed = next(p for p in st.session_state.inventario if p["ID_Barra"] == g_ed)
-                c1, c2, c3 = st.columns(3)
-                n_c = c1.text_input("Nombre Cliente", value=p_ed['Cliente'])
-                n_v = c2.number_input("Peso/Volumen", value=float(p_ed['Peso_Almacen'] if p_ed['Validado'] else p_ed['Peso_Mensajero']))
-                n_t = c3.selectbox("Tipo Traslado", ["Aéreo", "Marítimo", "Envio Nacional"], index=["Aéreo", "Marítimo", "Envio Nacional"].index(p_ed.get('Tipo_Traslado', 'Aéreo')))
-                cb1, cb2 = st.columns(2)
-                if cb1.button("💾 GUARDAR CAMBIOS"):
-                    p_ed.update({'Cliente': n_c, 'Tipo_Traslado': n_t, 'Monto_USD': calcular_monto(n_v, n_t, p_ed.get('Reempaque', False))})
-                    if p_ed['Validado']: p_ed['Peso_Almacen'] = n_v
-                    else: p_ed['Peso_Mensajero'] = n_v
-                    guardar_datos(st.session_state.inventario, ARCHIVO_DB); st.rerun()
-                if cb2.button("🗑️ ELIMINAR PAQUETE"):
-                    st.session_state.papelera.append(p_ed)
-                    st.session_state.inventario = [p for p in st.session_state.inventario if p["ID_Barra"] != g_ed]
-                    guardar_datos(st.session_state.inventario, ARCHIVO_DB); guardar_datos(st.session_state.papelera, ARCHIVO_PAPELERA); st.rerun()
-
-    with t_res:
-        st.subheader("📋 Resumen Logístico por Estados")
-        b_box = st.text_input("🔍 Localizar por Código de Caja:", key="res_box_search")
-        df_res = pd.DataFrame(st.session_state.inventario)
-        
-        if b_box and not df_res.empty:
-            df_res = df_res[df_res['ID_Barra'].astype(str).str.contains(b_box, case=False)]
-        
-        config_est = [
-            ("RECIBIDO ALMACEN PRINCIPAL", "📦 EN ALMACÉN ORIGEN"), 
-            ("EN TRANSITO", "✈️ EN TRÁNSITO"), 
-            ("RECIBIDO EN ALMACEN DE DESTINO", "🏢 ALMACÉN DESTINO"), 
-            ("ENTREGADO", "✅ ENTREGADO")
-        ]
+            st.success("✅ TOTALMENTE PAGADO")
+
+# --- Carga masiva ---
+# Un manifiesto (CSV/Excel) o una tanda de códigos escaneados se valida completo, se tarifa con
+# calcular_montos y se confirma con una sola escritura de inventario y otra de avisos.
+COLUMNAS_MANIFIESTO = ['ID_Barra', 'Cliente', 'Correo', 'Peso', 'Tipo_Traslado', 'Modalidad', 'Reempaque']
+
+def validar_manifiesto(df):
+    """Normaliza el manifiesto y devuelve (filas válidas, errores [(fila, motivo)])."""
+    df = df.rename(columns=lambda c: str(c).strip()).rename(columns={'Peso_Mensajero': 'Peso'}).reset_index(drop=True)
+    faltan = [c for c in ('Cliente', 'Correo', 'Peso') if c not in df.columns]
+    if faltan: return df.iloc[0:0], [(0, f"Faltan columnas: {', '.join(faltan)}")]
+    for col, defecto in (('ID_Barra', ''), ('Tipo_Traslado', 'Aéreo'), ('Modalidad', 'Pago Completo'), ('Reempaque', False)):
+        df[col] = df[col].fillna(defecto) if col in df.columns else defecto
+    df['ID_Barra'] = df['ID_Barra'].map(lambda i: i.strip() if isinstance(i, str) else '' if pd.isna(i) else str(i).strip())
+    df['Cliente'] = df['Cliente'].fillna('').astype(str).str.strip()
+    df['Correo'] = df['Correo'].fillna('').astype(str).str.lower().str.strip()
+    df['Peso'] = pd.to_numeric(df['Peso'], errors='coerce')
+    df['Reempaque'] = df['Reempaque'].astype(str).str.strip().str.lower().isin(['true', '1', 'si', 'sí', 'x'])
+    inventario, papelera = DATOS.obtener('inventario'), DATOS.obtener('papelera')
+    reglas = [
+        (df['Cliente'] == '', "Falta el nombre del cliente"),
+        (~df['Correo'].str.contains('@', regex=False), "Correo inválido"),
+        (df['Peso'].isna() | (df['Peso'] < 0), "Peso/volumen inválido"),
+        (~df['Tipo_Traslado'].isin(TIPOS_TRASLADO), "Tipo de traslado desconocido"),
+        (~df['Modalidad'].isin(MODALIDADES), "Modalidad de pago desconocida"),
+        ((df['ID_Barra'] != '') & df['ID_Barra'].duplicated(keep=False), "ID repetido en el manifiesto"),
+        (df['ID_Barra'].map(lambda i: i in inventario or i in papelera), "ID ya registrado"),
+        # Emitido por el asignador pero aún sin usar (p. ej. precargado en el REGISTRO de otra sesión).
+        (pd.Series(ASIGNADOR.emitidos(df['ID_Barra']), index=df.index) & ~df['ID_Barra'].map(lambda i: i in inventario or i in papelera), "ID reservado por el sistema"),
+    ]
+    errores = {}
+    for mascara, motivo in reglas:
+        for i in df.index[mascara]: errores.setdefault(i, []).append(motivo)
+    return df.drop(index=list(errores)), [(i + 1, "; ".join(m)) for i, m in sorted(errores.items())]
+
+def confirmar_lote(validos):
+    """Asigna IDs a las filas sin ID, tarifa en bloque y registra todo el lote. Devuelve los registros."""
+    validos = validos.copy()
+    sin_id = validos['ID_Barra'] == ''
+    validos.loc[sin_id, 'ID_Barra'] = ASIGNADOR.reservar(int(sin_id.sum()))
+    validos['Monto_USD'], version = tabla_tarifas().calcular(validos['Peso'], validos['Tipo_Traslado'], validos['Reempaque'])
+    ahora = datetime.now()
+    registros = [{"ID_Barra": r['ID_Barra'], "Cliente": r['Cliente'], "Correo": r['Correo'], "Peso_Mensajero": float(r['Peso']), "Peso_Almacen": 0.0, "Validado": False, "Monto_USD": float(r['Monto_USD']), "Estado": "RECIBIDO ALMACEN PRINCIPAL", "Pago": "PENDIENTE", "Modalidad": r['Modalidad'], "Tipo_Traslado": r['Tipo_Traslado'], "Reempaque": bool(r['Reempaque']), "Abonado": 0.0, "Fecha_Registro": ahora, "Historial_Pagos": [], "Tarifa_Version": version}
+                 for r in validos.to_dict('records')]
+    aplicar_lote('inventario', 'insert', registros)
+    por_cliente = validos.groupby('Correo', sort=False)['ID_Barra'].agg(list)
+    registrar_notificaciones([(correo, f"¡Hola! Hemos recibido {len(ids)} paquete(s) en origen: {', '.join(ids)}.") for correo, ids in por_cliente.items()])
+    return registros
+
+def render_carga_masiva():
+    origen = st.radio("Origen del lote", ["Manifiesto CSV/Excel", "Códigos escaneados"], horizontal=True, key="lote_origen")
+    firma, df = None, None
+    if origen == "Manifiesto CSV/Excel":
+        st.caption(f"Columnas: {', '.join(COLUMNAS_MANIFIESTO)} (ID_Barra, Tipo_Traslado, Modalidad y Reempaque son opcionales).")
+        archivo = st.file_uploader("Manifiesto", type=["csv", "xlsx"], key="lote_archivo")
+        if archivo is not None:
+            # Guardia de doble envío por contenido: otro manifiesto con el mismo nombre y tamaño sí se acepta.
+            firma = hashlib.sha256(archivo.getvalue()).hexdigest()
+            # ID_Barra como texto desde la lectura: inferido como número perdería ceros a la izquierda ("00123")
+            # o ganaría un ".0" si la columna tiene celdas vacías.
+            try: df = pd.read_csv(archivo, dtype={'ID_Barra': str}) if archivo.name.lower().endswith(".csv") else pd.read_excel(archivo, dtype={'ID_Barra': str})
+            except Exception as e: st.error(f"No se pudo leer el manifiesto: {e}")
+    else:
+        with st.form("lote_scan"):
+            codigos = st.text_area("Códigos escaneados (uno por línea)")
+            c1, c2 = st.columns(2)
+            cli, cor = c1.text_input("Nombre del Cliente"), c2.text_input("Correo del Cliente")
+            tra, mod = c1.selectbox("Tipo de Traslado", TIPOS_TRASLADO), c2.selectbox("Modalidad de Pago", MODALIDADES)
+            pes, reemp = c1.number_input("Peso/Volumen por caja", min_value=0.0, step=0.1), c2.checkbox("📦 Reempaque Especial")
+            if st.form_submit_button("VALIDAR CÓDIGOS"):
+                ids = [c.strip() for c in codigos.splitlines() if c.strip()]
+                st.session_state.lote_scan = pd.DataFrame({'ID_Barra': ids, 'Cliente': cli, 'Correo': cor, 'Peso': pes, 'Tipo_Traslado': tra, 'Modalidad': mod, 'Reempaque': reemp})
+        df = st.session_state.get('lote_scan')
+    if df is None: return
+    if firma is not None and firma == st.session_state.get('lote_confirmado'):
+        st.success("Este lote ya fue registrado."); return
+
+    validos, errores = validar_manifiesto(df)
+    st.write(f"**{len(validos)}** paquetes válidos · **{len(errores)}** filas con errores.")
+    if errores: st.dataframe(pd.DataFrame(errores, columns=["Fila", "Motivo"]), use_container_width=True, hide_index=True)
+    if len(validos) and st.button(f"REGISTRAR {len(validos)} PAQUETES", key="lote_ok"):
+        try: registros = confirmar_lote(validos)
+        except IDDuplicado as e:
+            st.error(f"Otra sesión registró antes estos IDs; revisa el lote: {', '.join(e.args[0])}"); return
+        st.session_state.lote_confirmado = firma
+        st.session_state.pop('lote_scan', None)
+        st.success(f"✅ {len(registros)} paquetes registrados en una sola operación.")
+
+@st.fragment
+@medido("pestaña.registro")
+def render_tab_registro():
+    st.subheader("Registro de Entrada")
+    if st.radio("Modo de ingreso", ["Individual", "Carga masiva"], horizontal=True, key="reg_modo") == "Carga masiva":
+        render_carga_masiva(); return
+    f_tra = st.selectbox("Tipo de Traslado", TIPOS_TRASLADO)
+    label_din = "Pies Cúbicos (ft³)" if f_tra == "Marítimo" else "Peso (Kilogramos)"
+    with st.form("reg_form"):
+        col1, col2 = st.columns(2)
+        f_id = col1.text_input("ID Tracking / Guía", value=st.session_state.id_actual)
+        f_cli = col2.text_input("Nombre del Cliente")
+        f_cor = col1.text_input("Correo del Cliente")
+        f_pes = col2.number_input(label_din, min_value=0.0, step=0.1)
+        f_mod = st.selectbox("Modalidad de Pago", MODALIDADES)
+        f_reemp = st.checkbox(f"📦 ¿Solicita Reempaque Especial? (+${float(tabla_tarifas().vigente().get('reempaque', COSTO_REEMPAQUE_FIJO)):.2f})")
+        if st.form_submit_button("REGISTRAR PAQUETE"):
+            if f_id in DATOS.obtener('inventario') or f_id in DATOS.obtener('papelera'): st.error(f"El ID {f_id} ya está registrado.")
+            elif f_id != st.session_state.id_actual and ASIGNADOR.emitidos([f_id])[0]: st.error(f"El ID {f_id} está reservado por el sistema.")
+            elif f_id and f_cli and f_cor:
+                monto_calc = calcular_monto(f_pes, f_tra, f_reemp)
+                nuevo = {"ID_Barra": f_id, "Cliente": f_cli, "Correo": f_cor.lower().strip(), "Peso_Mensajero": f_pes, "Peso_Almacen": 0.0, "Validado": False, "Monto_USD": monto_calc, "Estado": "RECIBIDO ALMACEN PRINCIPAL", "Pago": "PENDIENTE", "Modalidad": f_mod, "Tipo_Traslado": f_tra, "Reempaque": f_reemp, "Abonado": 0.0, "Fecha_Registro": datetime.now(), "Historial_Pagos": [], "Tarifa_Version": version_tarifa_vigente()}
+                if not aplicar_alta('inventario', nuevo): return
+                registrar_notificacion(f_cor.lower().strip(), f"¡Hola! Hemos recibido tu paquete {f_id} en origen.")
+                st.session_state.id_actual = generar_id_unico()
+                st.rerun(scope="fragment")
+
+@st.fragment
+@medido("pestaña.validacion")
+def render_tab_validacion():
+    st.subheader("Validación de Carga")
+    pendientes = listar_ids('inventario', iguales={'Validado': False})
+    if pendientes:
+        guia_v = st.selectbox("Guía a validar:", pendientes)
+        paq = consultar_datos('inventario', iguales={'ID_Barra': guia_v})[0]
+        st.warning(f"Declarado por mensajero: {paq['Peso_Mensajero']} ({paq['Tipo_Traslado']})")
+        valor_real = st.number_input("Medición Real en Almacén:", min_value=0.0, value=float(paq['Peso_Mensajero']))
+        esperada = version_vista("val_ver", paq)
+        if st.button("CONFIRMAR VALIDACIÓN"):
+            nuevo = dict(paq, Peso_Almacen=valor_real, Validado=True, Monto_USD=calcular_monto(valor_real, paq['Tipo_Traslado'], paq.get('Reempaque', False)), Tarifa_Version=version_tarifa_vigente())
+            if aplicar_edicion('inventario', 'update', nuevo, esperada): st.rerun(scope="fragment")
+
+@st.fragment
+@medido("pestaña.cobros")
+def render_tab_cobros():
+    st.subheader("Gestión de Cobros")
+    busq_cobro = st.text_input("🔍 Buscar paquete o cliente para cobrar:", key="sc")
+    filtro = {'distintos': {'Pago': 'PAGADO'}}
+    # Sin búsqueda el total sale del índice de Pago y solo se leen las filas de la página visible.
+    p_pago = avisar_limite(consultar_datos('inventario', texto=busq_cobro, limite=LIMITE_BUSQUEDA, **filtro)) if busq_cobro else None
+    total = len(p_pago) if busq_cobro else contar_datos('inventario', **filtro)
+    if not total:
+        st.success("Sin cobros pendientes."); return
+
+    ini, fin = paginar(total, "cob")
+    filas = p_pago[ini:fin] if busq_cobro else pagina_datos('inventario', ini, fin, **filtro)
+    pagina = {p['ID_Barra']: p for p in filas}
+    st.markdown("".join(_fila_cobro_html(p) for p in pagina.values()), unsafe_allow_html=True)
+    sel = st.selectbox("💵 Paquete a cobrar:", list(pagina), format_func=lambda i: f"{pagina[i]['Cliente']} | {i} ({pagina[i].get('Modalidad', 'N/A')})", key="cob_sel")
+    p = pagina[sel]
+    rest = max(0.0, float(p['Monto_USD']) - float(p['Abonado']))
+    st.write(f"Deuda Total: ${rest:.2f}")
+    m_abono = st.number_input(f"Abonar a {p['ID_Barra']}:", 0.0, float(rest), float(rest), key=f"c_{p['ID_Barra']}")
+    esperada = version_vista("cob_ver", p)
+    if st.button("REGISTRAR PAGO", key="b_cobro"):
+        nuevo = dict(p, Abonado=float(p['Abonado']) + m_abono)
+        if (float(nuevo['Monto_USD']) - nuevo['Abonado']) <= 0.01: nuevo['Pago'] = 'PAGADO'
+        if aplicar_edicion('inventario', 'update', nuevo, esperada): st.rerun(scope="fragment")
+
+@st.fragment
+@medido("pestaña.estados")
+def render_tab_estados():
+    st.subheader("Actualizar Ubicación")
+    if DATOS.obtener('inventario'):
+        guia_est = st.selectbox("Seleccionar Guía:", listar_ids('inventario'))
+        paq = consultar_datos('inventario', iguales={'ID_Barra': guia_est})[0]
+        idx_st = ESTADOS.index(paq['Estado']) if paq['Estado'] in ESTADOS else 0
+        n_st = st.selectbox("Nuevo Estado:", ESTADOS, index=idx_st)
+        esperada = version_vista("est_ver", paq)
+        if st.button("ACTUALIZAR ESTATUS"):
+            if aplicar_edicion('inventario', 'update', dict(paq, Estado=n_st), esperada):
+                registrar_notificacion(paq['Correo'], f"Tu paquete {paq['ID_Barra']} está en: {n_st}")
+                st.rerun(scope="fragment")
+
+def render_respaldo_csv():
+    with st.expander("💾 Respaldo CSV (exportar / importar)"):
+        clave = st.selectbox("Datos", list(ARCHIVOS), key="resp_clave")
+        if st.button("📤 EXPORTAR", key="resp_exp"):
+            ruta = exportar_csv(ARCHIVOS[clave])
+            with open(ruta, "rb") as f: st.download_button(f"Descargar {os.path.basename(ruta)}", f.read(), file_name=os.path.basename(ruta), mime="text/csv")
+        origen = st.file_uploader("CSV a importar (reemplaza todo el contenido)", type=["csv"], key="resp_csv")
+        if origen is not None and st.checkbox("Confirmo que se reemplazarán los datos actuales", key="resp_ok") and st.button("📥 IMPORTAR", key="resp_imp"):
+            try: st.success(f"{len(importar_respaldo(clave, origen))} registros importados en {clave}.")
+            except Exception as e: st.error(f"No se pudo importar: {e}")
+
+@st.fragment
+@medido("pestaña.auditoria")
+def render_tab_auditoria():
+    st.subheader("🕵️ Auditoría y Gestión")
+    render_respaldo_csv()
+    v_papelera = st.checkbox("📂 Ver Papelera de Reciclaje")
+    if v_papelera:
+        if DATOS.obtener('papelera'):
+            g_res = st.selectbox("Restaurar ID:", listar_ids('papelera'))
+            if st.button("♻️ RESTAURAR SELECCIONADO"):
+                paq_r = consultar_datos('papelera', iguales={'ID_Barra': g_res})[0]
+                if aplicar_alta('inventario', paq_r, traslado=True):
+                    aplicar_cambio('papelera', 'delete', paq_r); st.rerun(scope="fragment")
+        else: st.info("Papelera vacía.")
+    else:
+        busq_aud = st.text_input("🔍 Buscar en historial:", key="aud_s")
+        df_aud = marco_inventario()
+        if busq_aud: df_aud = df_aud[df_aud.index.isin(avisar_limite(listar_ids('inventario', texto=busq_aud, limite=LIMITE_BUSQUEDA)))]
+        st.dataframe(df_aud, use_container_width=True, hide_index=True)
         
-        for est_id, label in config_est:
-            df_f = df_res[df_res['Estado'] == est_id] if not df_res.empty else pd.DataFrame()
-            
-            with st.expander(f"{label} ({len(df_f)})", expanded=True if b_box else False):
-                if not df_f.empty:
-                    for _, r in df_f.iterrows():
-                        f_reg = pd.to_datetime(r['Fecha_Registro']).strftime('%d/%m/%y')
-                        icon = obtener_icono_transporte(r.get('Tipo_Traslado'))
-                        badge_reempaque = ' <span style="color:#a78bfa; font-size:10px; font-weight:bold;">[REEMPAQUE]</span>' if r.get("Reempaque") else ""
-                        modalidad = r.get('Modalidad', 'Pago Completo')
-                        
-                        st.markdown(f"""
-                            <div class="resumen-row">
-                                <div style="display: flex; align-items: center; gap: 15px;">
-                                    <div style="color:#2563eb; font-weight:800; min-width:110px;">{icon} {r["ID_Barra"]}</div>
-                                    <div style="border-left: 1px solid #cbd5e1; height: 20px;"></div>
-                                    <div>
-                                        <b style="color:#1e293b;">{r["Cliente"]}</b>
-                                        <div style="font-size:10px; color:#64748b;">Registrado: {f_reg} | {modalidad}{badge_reempaque}</div>
-                                    </div>
-                                </div>
-                                <div style="color:#64748b; font-size:12px; font-weight:700;">{r["Tipo_Traslado"]}</div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        
-                        with st.expander(f"🔍 DETALLES DE {r['ID_Barra']}"):
-                            rest_p = float(r['Monto_USD']) - float(r['Abonado'])
-                            c_aud1, c_aud2 = st.columns(2)
-                            with c_aud1:
-                                st.write(f"**Cliente:** {r['Cliente']}")
-                                st.write(f"**Correo:** {r['Correo']}")
-                                st.write(f"**Modalidad:** {modalidad}")
-                            with c_aud2:
-                                st.write(f"**Monto Total:** ${float(r['Monto_USD']):.2f}")
-                                st.write(f"**Abonado:** ${float(r['Abonado']):.2f}")
-                                if rest_p > 0:
-                                    st.error(f"**Pendiente:** ${rest_p:.2f}")
-                                else:
-                                    st.success("✅ TOTALMENTE PAGADO")
-                        
-                        st.markdown("<div style='margin-bottom: 10px;'></div>", unsafe_allow_html=True)
+        if DATOS.obtener('inventario'):
+            st.markdown("---")
+            st.subheader("📝 Editar Paquete Seleccionado")
+            g_ed = st.selectbox("ID para modificar:", listar_ids('inventario'))
+            p_ed = consultar_datos('inventario', iguales={'ID_Barra': g_ed})[0]
+            c1, c2, c3 = st.columns(3)
+            n_c = c1.text_input("Nombre Cliente", value=p_ed['Cliente'])
+            n_v = c2.number_input("Peso/Volumen", value=float(p_ed['Peso_Almacen'] if p_ed['Validado'] else p_ed['Peso_Mensajero']))
+            n_t = c3.selectbox("Tipo Traslado", TIPOS_TRASLADO, index=TIPOS_TRASLADO.index(p_ed.get('Tipo_Traslado', 'Aéreo')))
+            cb1, cb2 = st.columns(2)
+            esperada = version_vista("aud_ver", p_ed)
+            if cb1.button("💾 GUARDAR CAMBIOS"):
+                nuevo = dict(p_ed, Cliente=n_c, Tipo_Traslado=n_t, Monto_USD=calcular_monto(n_v, n_t, p_ed.get('Reempaque', False)), Tarifa_Version=version_tarifa_vigente())
+                nuevo['Peso_Almacen' if p_ed['Validado'] else 'Peso_Mensajero'] = n_v
+                if aplicar_edicion('inventario', 'update', nuevo, esperada): st.rerun(scope="fragment")
+            if cb2.button("🗑️ ELIMINAR PAQUETE"):
+                if aplicar_edicion('inventario', 'delete', p_ed, esperada):
+                    if aplicar_alta('papelera', p_ed): st.rerun(scope="fragment")
+
+@st.fragment
+@medido("pestaña.resumen")
+def render_tab_resumen():
+    st.subheader("📋 Resumen Logístico por Estados")
+    b_box = st.text_input("🔍 Localizar por Código de Caja:", key="res_box_search")
+    df_res = marco_inventario()
+    if b_box: df_res = df_res[df_res.index.isin(avisar_limite(listar_ids('inventario', texto=b_box, campos_texto=('ID_Barra',), limite=LIMITE_BUSQUEDA)))]
+    
+    config_est = [
+        ("RECIBIDO ALMACEN PRINCIPAL", "📦 EN ALMACÉN ORIGEN"), 
+        ("EN TRANSITO", "✈️ EN TRÁNSITO"), 
+        ("RECIBIDO EN ALMACEN DE DESTINO", "🏢 ALMACÉN DESTINO"), 
+        ("ENTREGADO", "✅ ENTREGADO")
+    ]
+    conteos = df_res['Estado'].value_counts()
+    
+    for est_id, label in config_est:
+        n = int(conteos.get(est_id, 0))
+        with st.expander(f"{label} ({n})", expanded=True if b_box else False):
+            if n:
+                ini, fin = paginar(n, f"res_{est_id}")
+                filas = df_res[df_res['Estado'] == est_id].iloc[ini:fin].to_dict('records')
+                st.markdown("".join(_fila_resumen_html(r) for r in filas), unsafe_allow_html=True)
+                sel = st.selectbox("🔍 Ver detalles de:", [None] + [r['ID_Barra'] for r in filas], format_func=lambda i: "—" if i is None else i, key=f"det_{est_id}")
+                if sel: render_detalle_paquete(consultar_datos('inventario', iguales={'ID_Barra': sel})[0])
+            else:
+                st.write("No hay paquetes en esta categoría.")
+
+@st.fragment
+@medido("pestaña.alertas")
+def render_tab_alertas():
+    st.subheader("🚨 Centro de Alertas Críticas")
+    ca1, ca2 = st.columns(2)
+    inv = DATOS.obtener('inventario')
+    discrepancias, morosos = alertas_inventario()
+    with ca1:
+        st.markdown("#### ⚖️ Variación de Peso/Volumen")
+        if discrepancias:
+            for a in filter(None, map(inv.por_id, discrepancias)):
+                diff = abs(float(a['Peso_Mensajero']) - float(a['Peso_Almacen']))
+                with st.expander(f"⚠️ DISCREPANCIA: {a['ID_Barra']}", expanded=True):
+                    st.error(f"Variación de **{diff:.2f}** detectada.")
+                    st.write(f"Mensajero: {a['Peso_Mensajero']} vs Almacén: {a['Peso_Almacen']}")
+        else: st.success("Todo validado correctamente.")
+
+    with ca2:
+        st.markdown(f"#### ⏳ Morosidad (+{DIAS_MOROSIDAD} días)")
+        hoy = datetime.now()
+        if morosos:
+            for m in filter(None, map(inv.por_id, morosos)):
+                dias = (hoy - pd.to_datetime(m['Fecha_Registro'])).days
+                with st.expander(f"🛑 CRÍTICO: {m['Cliente']}", expanded=True):
+                    st.warning(f"Paquete {m['ID_Barra']} lleva **{dias} días** pendiente.")
+                    st.write(f"Monto pendiente: ${float(m['Monto_USD']) - float(m['Abonado']):.2f}")
+        else: st.success("Sin pagos atrasados.")
+
+def _tramos_a_texto(tramos): return ", ".join(f"{'*' if h is None else h}:{t}" for h, t in tramos)
+
+def _texto_a_tramos(texto):
+    """'10:6.0, 50:5.5, *:5.0' -> [[10.0, 6.0], [50.0, 5.5], [None, 5.0]]; ValueError si no es válido."""
+    tramos = []
+    for parte in (p.strip() for p in texto.split(",") if p.strip()):
+        hasta, tarifa = parte.split(":")
+        tramos.append([None if hasta.strip() == "*" else float(hasta), float(tarifa)])
+    limites = [h for h, _ in tramos[:-1]]
+    if not tramos or tramos[-1][0] is not None or None in limites or limites != sorted(limites): raise ValueError(texto)
+    return tramos
+
+@st.fragment
+@medido("pestaña.tarifas")
+def render_tab_tarifas():
+    st.subheader("💲 Tabla de Tarifas")
+    tabla = tabla_tarifas()
+    vigente = tabla.vigente()
+    st.dataframe(pd.DataFrame([{"Versión": v['version'], "Vigente desde": v['vigente_desde'], "Reempaque": v.get('reempaque'), **{m: _tramos_a_texto(t) for m, t in v['modos'].items()}} for v in tabla.versiones]), use_container_width=True, hide_index=True)
+    st.caption(f"Versión vigente hoy: **{vigente['version']}**")
+    with st.form("tarifa_nueva"):
+        c1, c2, c3 = st.columns(3)
+        nombre = c1.text_input("Nombre de la versión")
+        desde = c2.date_input("Vigente desde")
+        reemp = c3.number_input("Reempaque", min_value=0.0, value=float(vigente.get('reempaque', COSTO_REEMPAQUE_FIJO)))
+        st.caption("Tramos por modo como 'hasta:tarifa' separados por comas; el último tramo usa '*' (ej. 10:6.0, *:5.5).")
+        textos = {m: st.text_input(m, value=_tramos_a_texto(vigente['modos'].get(m, [[None, 0.0]]))) for m in TIPOS_TRASLADO}
+        if st.form_submit_button("GUARDAR VERSIÓN"):
+            try: modos = {m: _texto_a_tramos(t) for m, t in textos.items()}
+            except ValueError: st.error("Formato de tramos inválido.")
+            else:
+                if not nombre or nombre in {v['version'] for v in tabla.versiones}: st.error("Indica un nombre de versión nuevo.")
                 else:
-                    st.write("No hay paquetes en esta categoría.")
-
-    with t_ale:
-        st.subheader("🚨 Centro de Alertas Críticas")
-        ca1, ca2 = st.columns(2)
-        with ca1:
-            st.markdown("#### ⚖️ Variación de Peso/Volumen")
-            alertas_p = [p for p in st.session_state.inventario if p.get('Validado') and abs(float(p['Peso_Mensajero']) - float(p['Peso_Almacen'])) > 0.01]
-            if alertas_p:
-                for a in alertas_p:
-                    diff = abs(float(a['Peso_Mensajero']) - float(a['Peso_Almacen']))
-                    with st.expander(f"⚠️ DISCREPANCIA: {a['ID_Barra']}", expanded=True):
-                        st.error(f"Variación de **{diff:.2f}** detectada.")
-                        st.write(f"Mensajero: {a['Peso_Mensajero']} vs Almacén: {a['Peso_Almacen']}")
-            else: st.success("Todo validado correctamente.")
-
-        with ca2:
-            st.markdown("#### ⏳ Morosidad (+15 días)")
-            hoy = datetime.now()
-            alertas_m = [p for p in st.session_state.inventario if p['Pago'] != 'PAGADO' and (hoy - pd.to_datetime(p['Fecha_Registro'])).days > 15]
-            if alertas_m:
-                for m in alertas_m:
-                    dias = (hoy - pd.to_datetime(m['Fecha_Registro'])).days
-                    with st.expander(f"🛑 CRÍTICO: {m['Cliente']}", expanded=True):
-                        st.warning(f"Paquete {m['ID_Barra']} lleva **{dias} días** pendiente.")
-                        st.write(f"Monto pendiente: ${float(m['Monto_USD']) - float(m['Abonado']):.2f}")
-            else: st.success("Sin pagos atrasados.")
+                    tabla.agregar_version({"version": nombre, "vigente_desde": desde.strftime("%Y-%m-%d"), "reempaque": reemp, "modos": modos})
+                    st.rerun(scope="fragment")
+
+    st.markdown("---")
+    inv = DATOS.obtener('inventario')
+    n_pend = len(inv) - inv.contar('Pago', 'PAGADO')
+    if st.button(f"♻️ REPRECIAR {n_pend} PAQUETES PENDIENTES CON '{vigente['version']}'"):
+        n, seg = repreciar_pendientes()
+        st.success(f"{n} paquetes repreciados en {seg * 1000:.0f} ms.")
+
+PESTANAS_ADMIN = {
+    "📥 REGISTRO": render_tab_registro, "⚖️ VALIDACIÓN": render_tab_validacion, "💰 COBROS": render_tab_cobros,
+    "📍 ESTADOS": render_tab_estados, "🔍 AUDITORÍA": render_tab_auditoria, "📊 RESUMEN": render_tab_resumen, "🚨 ALERTAS": render_tab_alertas,
+    "💲 TARIFAS": render_tab_tarifas,
+}
+
+@st.fragment
+def render_tab_diagnostico():
+    st.subheader("🩺 Diagnóstico de Rendimiento")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Reruns de esta sesión", st.session_state.get('reruns', 0))
+    c2.metric("Filas leídas", f"{METRICAS.contadores.get('filas_leidas', 0):,}")
+    c3.metric("Bytes escritos", f"{METRICAS.contadores.get('bytes_escritos', 0):,}")
+    resumen = METRICAS.resumen()
+    if resumen: st.dataframe(pd.DataFrame(resumen).round(2), use_container_width=True, hide_index=True)
+    else: st.info("Sin mediciones todavía.")
+    st.dataframe(pd.DataFrame(sorted(METRICAS.contadores.items()), columns=["Contador", "Valor"]), use_container_width=True, hide_index=True)
+    b1, b2, b3 = st.columns(3)
+    b1.button("🔄 ACTUALIZAR")
+    if b2.button("💾 EXPORTAR MÉTRICAS"): st.success(f"Anexado a {METRICAS.exportar()}")
+    if b3.button("🧹 REINICIAR"):
+        METRICAS.reiniciar(); st.rerun(scope="fragment")
+
+if METRICAS_ACTIVAS: PESTANAS_ADMIN["🩺 DIAGNÓSTICO"] = render_tab_diagnostico
+
+@medido("admin.dashboard")
+def render_admin_dashboard():
+    st.markdown('<div class="welcome-text">Consola de Control Logístico</div>', unsafe_allow_html=True)
+    activa = st.radio("Sección", list(PESTANAS_ADMIN), horizontal=True, key="tab_admin", label_visibility="collapsed")
+    PESTANAS_ADMIN[activa]()
 
 # --- 4. DASHBOARD CLIENTE ---
+@medido("cliente.dashboard")
 def render_client_dashboard():
     u = st.session_state.usuario_identificado
     st.markdown(f'<div class="welcome-text">Bienvenido, {u["nombre"]}</div>', unsafe_allow_html=True)
-    mis_p = [p for p in st.session_state.inventario if str(p.get('Correo', '')).lower() == u['correo'].lower()]
+    mis_p = consultar_datos('inventario', iguales={'Correo': u['correo'].lower()})
     
     if not mis_p: 
         st.info("No tienes envíos activos en este momento.")
     else:
-        st.text_input("🔍 Buscar entre mis paquetes:", key="cli_s")
+        cli_s = st.text_input("🔍 Buscar entre mis paquetes:", key="cli_s")
+        if cli_s:
+            mis_p = avisar_limite(consultar_datos('inventario', iguales={'Correo': u['correo'].lower()}, texto=cli_s, limite=LIMITE_BUSQUEDA))
+            if not mis_p: st.info("Ningún paquete coincide con la búsqueda.")
         c1, c2 = st.columns(2)
         for i, p in enumerate(mis_p):
             with (c1 if i % 2 == 0 else c2):
@@ -392,17 +1722,34 @@ def render_client_dashboard():
                 """, unsafe_allow_html=True)
 
 # --- 5. LOGICA ACCESO ---
+# La campana es un fragmento propio que se refresca solo cada INTERVALO_CAMPANA: recoge los avisos
+# que generan las pestañas (o las escrituras de otras sesiones) sin volver a ejecutar la página.
+INTERVALO_CAMPANA = os.environ.get("IACARGO_INTERVALO_CAMPANA", "5s")
+
+@st.fragment(run_every=INTERVALO_CAMPANA)
+def render_campana():
+    u = st.session_state.usuario_identificado
+    if u is None: return
+    target = 'admin' if u['rol'] == 'admin' else u['correo']
+    mías = DATOS.obtener('notificaciones').ultimos(target, 5)
+    with st.popover("🔔"):
+        if mías:
+            for n in mías: st.write(f"**{formatear_hora_aviso(n)}**: {n['msg']}")
+        else: st.write("Sin avisos.")
+    if u['rol'] == 'admin':
+        discrepancias, morosos = alertas_inventario()
+        st.caption(f"⚖️ {len(discrepancias)} · ⏳ {len(morosos)}")
+    # Confirmación de durabilidad de las escrituras propias de la sesión (EscritorGrupal); el último fallo
+    # de cualquier sesión solo lo ve el admin.
+    error = ESCRITOR.fallo(st.session_state.get('ticket_escritura')) or (ESCRITOR.error if u['rol'] == 'admin' else None)
+    if error: st.caption(f"❌ {error}")
+    elif ESCRITOR.confirmado < st.session_state.get('ticket_escritura', 0): st.caption("💾 guardando…")
+    elif 'ticket_escritura' in st.session_state: st.caption("✅ guardado")
+
 def render_header():
     col_l, col_n, col_s = st.columns([7, 1, 2])
     with col_l: st.markdown('<div class="logo-animado" style="font-size:40px;">IACargo.io</div>', unsafe_allow_html=True)
-    with col_n:
-        u = st.session_state.usuario_identificado
-        target = 'admin' if u['rol'] == 'admin' else u['correo']
-        mías = [n for n in st.session_state.notificaciones if n['para'] == target]
-        with st.popover("🔔"):
-            if mías:
-                for n in mías[:5]: st.write(f"**{n['hora']}**: {n['msg']}")
-            else: st.write("Sin avisos.")
+    with col_n: render_campana()
     with col_s:
         if st.button("Cerrar Sesión"):
             st.session_state.usuario_identificado = None; st.session_state.landing_vista = True; st.rerun()
@@ -423,7 +1770,7 @@ if st.session_state.usuario_identificado is None:
                     if st.form_submit_button("ACCEDER"):
                         if le == "admin" and lp == "admin123": 
                             st.session_state.usuario_identificado = {"nombre": "Admin", "rol": "admin", "correo": "admin"}; st.rerun()
-                        u = next((u for u in st.session_state.usuarios if u['correo'] == le.lower().strip() and u['password'] == hash_password(lp)), None)
+                        u = next((u for u in consultar_datos('usuarios', iguales={'Correo': le.lower().strip()}) if u['password'] == hash_password(lp)), None)
                         if u: st.session_state.usuario_identificado = u; st.rerun()
                         else: st.error("Credenciales incorrectas")
             with t2:
@@ -431,8 +1778,11 @@ if st.session_state.usuario_identificado is None:
                     n, e, p = st.text_input("Nombre Completo"), st.text_input("Email"), st.text_input("Contraseña", type="password")
                     if st.form_submit_button("CREAR CUENTA"):
                         if n and e and p:
-                            st.session_state.usuarios.append({"nombre": n, "correo": e.lower().strip(), "password": hash_password(p), "rol": "cliente"})
-                            guardar_datos(st.session_state.usuarios, ARCHIVO_USUARIOS); st.success("¡Registrado!"); st.rerun()
+                            with DATOS.bloqueo:
+                                nuevo = {"nombre": n, "correo": e.lower().strip(), "password": hash_password(p), "rol": "cliente"}
+                                DATOS.obtener('usuarios').append(nuevo)
+                                ESCRITOR.encolar('usuarios', 'append', [nuevo])
+                            st.success("¡Registrado!"); st.rerun()
 else:
     render_header()
     if st.session_state.usuario_identificado['rol'] == "admin": render_admin_dashboard()